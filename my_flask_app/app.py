@@ -1,123 +1,440 @@
 import sqlite3
-import random
 import os
-import pytz
+import re
+import time
+import threading
+import click
+from collections import OrderedDict
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Response, abort, g, has_request_context, render_template, request, jsonify, session, redirect, url_for
+from werkzeug.security import generate_password_hash
+from state import live, save_roster_changes, SL_TZ
+from heartbeat import DEFAULT_DEVICE
+from events import EventBroker, format_sse
+from db import ConnectionPool, LockStats
+from ingest import IngestQueue
+from migrations import migrate, check_query_plans, schema_version, LATEST_VERSION
+from shared import LocalBackend, make_backend
+from metrics import Metrics, current_route
+from auth import AuthBusy, PasswordHasher, RateLimiter
+from snapshots import Snapshot, pick_encoding
+from zones import DEFAULT_ZONE, parse_zone_id
+import rollups
+import slots
+import pages
+import retention
+import atexit
 
 app = Flask(__name__)
 
 # --- CONFIGURATION ---
 app.secret_key = "super_secret_key_change_this" 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, 'library.db')
+DB_FILE = os.environ.get('SEATIDLE_DB', os.path.join(BASE_DIR, 'library.db'))
+DB_POOL_SIZE = int(os.environ.get('SEATIDLE_DB_POOL', '8'))  # 0 = no pooling, no tuning (old behaviour)
+HEARTBEAT_PERSIST_SECONDS = int(os.environ.get('SEATIDLE_HEARTBEAT_PERSIST', '60'))  # DB write interval while a device stays online
+INGEST_MODE = os.environ.get('SEATIDLE_INGEST_MODE', 'async')  # 'async' = batched writer, 'sync' = write in the request
+INGEST_WINDOW_MS = int(os.environ.get('SEATIDLE_INGEST_WINDOW_MS', '50'))
+INGEST_BATCH_MAX = int(os.environ.get('SEATIDLE_INGEST_BATCH_MAX', '200'))
+INGEST_ON_EXIT = os.environ.get('SEATIDLE_INGEST_ON_EXIT', 'flush')  # 'flush' or 'drop' queued events at shutdown
+LOG_RETENTION_DAYS = int(os.environ.get('SEATIDLE_LOG_RETENTION_DAYS', '90'))  # raw events kept in library.db
+ARCHIVE_DIR = os.environ.get('SEATIDLE_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+RETENTION_INTERVAL_HOURS = float(os.environ.get('SEATIDLE_RETENTION_INTERVAL_HOURS', '6'))  # 0 = only via `flask compact-logs`
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SEATIDLE_SSE_MAX_SUBSCRIBERS', '100'))  # per worker process; gunicorn.conf.py keeps it below the threads
+SSE_KEEPALIVE = 15  # seconds between keep-alive comments on idle streams
+SLOT_CAPACITY = int(os.environ.get('SEATIDLE_SLOT_CAPACITY', '0'))  # bookings allowed per slot and zone; 0 = the zone's capacity
+SLOT_SWEEP_SECONDS = 30  # how often no-shows are expired and the dashboard's current slot re-checked
+ANNOUNCEMENTS_SHOWN = 20  # the admin panel lists only the latest ones
+STATE_BACKEND = os.environ.get('SEATIDLE_STATE_BACKEND', 'local')  # 'sqlite' when running several worker processes
+DB_LOCK_STATS = os.environ.get('SEATIDLE_DB_LOCK_STATS') == '1'  # count SQLite lock waits (load tests; benchmarks/fleet.py)
+METRICS_ENABLED = os.environ.get('SEATIDLE_METRICS', '1') == '1'  # request/SQL/template timings at /metrics
+METRICS_TOKEN = os.environ.get('SEATIDLE_METRICS_TOKEN')  # lets a scraper in with "Authorization: Bearer <token>"
+SLOW_REQUEST_MS = float(os.environ.get('SEATIDLE_SLOW_REQUEST_MS', '0'))  # log slower requests with their queries; 0 = off
+PASSWORD_HASH = os.environ.get('SEATIDLE_PASSWORD_HASH', 'scrypt')  # werkzeug method string; older hashes are upgraded on login
+AUTH_WORKERS = int(os.environ.get('SEATIDLE_AUTH_WORKERS', '2'))  # password hashing threads per worker process
+AUTH_MAX_PENDING = int(os.environ.get('SEATIDLE_AUTH_MAX_PENDING', '8'))  # logins/registrations in flight; keep below the request threads (gunicorn.conf.py)
+LOGIN_IP_PER_MINUTE = float(os.environ.get('SEATIDLE_LOGIN_IP_PER_MINUTE', '30'))  # generous: a campus shares few IPs
+LOGIN_IP_BURST = 20
+LOGIN_USER_PER_MINUTE = 5  # wrong passwords per username and client IP; a successful login refills it
+LOGIN_USER_BURST = 5
 
 # --- TIMEZONE HELPER ---
-def get_sl_time():
-    sl_timezone = pytz.timezone('Asia/Colombo')
-    return datetime.now(sl_timezone).strftime("%Y-%m-%d %H:%M:%S")
+# NEW: SL_TZ is looked up once (state.py); pass `ts` to format an epoch you also store
+def get_sl_time(ts=None):
+    now = datetime.now(SL_TZ) if ts is None else datetime.fromtimestamp(ts, SL_TZ)
+    return now.strftime("%Y-%m-%d %H:%M:%S")
 
 # --- DATABASE SETUP ---
+# NEW: Lock waits are counted per request path, or per thread for background writers
+db_lock_stats = LockStats(label=lambda: request.path if has_request_context() else threading.current_thread().name) if DB_LOCK_STATS else None
+metrics = Metrics(slow_ms=SLOW_REQUEST_MS) if METRICS_ENABLED else None
+hasher = PasswordHasher(PASSWORD_HASH, workers=AUTH_WORKERS, max_pending=AUTH_MAX_PENDING)
+ip_limiter = RateLimiter(LOGIN_IP_PER_MINUTE, LOGIN_IP_BURST)
+user_limiter = RateLimiter(LOGIN_USER_PER_MINUTE, LOGIN_USER_BURST)
+pool = ConnectionPool(DB_FILE, size=DB_POOL_SIZE, tuned=DB_POOL_SIZE > 0, lock_stats=db_lock_stats,
+                      observer=metrics.observe_query if metrics else None)
+if metrics: metrics.init_app(app)
+
+# NEW: One pooled connection per request, handed back when the request ends
+def get_db():
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None: pool.release(conn)
+
+# Migrates the schema and makes sure an admin exists; `flask --app app migrate` (once per deploy),
+# the gunicorn master and the dev server run it, create_app() doesn't
 def init_db():
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS status (id INTEGER PRIMARY KEY, available_seats INTEGER)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS staff (uid TEXT PRIMARY KEY, name TEXT, is_present INTEGER, last_seen TEXT)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS announcements (id INTEGER PRIMARY KEY, message TEXT, created_at TEXT)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, event_type TEXT, user_type TEXT, occupancy INTEGER)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS reservations (otp TEXT PRIMARY KEY, name TEXT, res_date TEXT, time_slot TEXT, created_at TEXT, is_used INTEGER, user_id INTEGER)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password TEXT, role TEXT)''')
-
-        cursor.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', ('total_capacity', '50'))
-
-        cursor.execute('SELECT count(*) FROM status')
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('INSERT INTO status (id, available_seats) VALUES (1, 50)')
-        
-        cursor.execute('SELECT * FROM users WHERE role = "admin"')
+    with pool.connection() as conn:
+        migrate(conn) # Tables and indexes live in migrations.py
+        cursor = conn.cursor() # Capacity and seats live in `zones` now; migration 9 creates zone 1
+
+        cursor.execute("SELECT * FROM users WHERE role = 'admin'")
         if not cursor.fetchone():
-            hashed_pw = generate_password_hash("admin123")
+            hashed_pw = generate_password_hash("admin123", PASSWORD_HASH)
             cursor.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)', ("admin", hashed_pw, "admin"))
         conn.commit()
 
-init_db()
+# --- APP FACTORY ---
+# Importing this module does no I/O. create_app() readies the process: live
+# state, ingest writer and shared-state backend. Of the schema it only reads
+# PRAGMA user_version, so a worker or test boots in milliseconds; migrating is
+# a separate one-shot step. Entry points:
+#   flask --app app migrate                     migrations + admin account
+#   python app.py                               dev server (runs migrations)
+#   flask --app app:create_app <command>        CLI
+#   gunicorn -c gunicorn.conf.py                production; migrations run once
+#                                               in the master, see wsgi.py
+#   python benchmarks/bench_startup.py          import/create_app/first request times
+backend = LocalBackend()
+ingest = None
+_app_ready = False
+
+def create_app(migrate_schema=False):
+    global backend, ingest, _app_ready
+    if _app_ready: return app
+    if migrate_schema:
+        init_db()
+    else:
+        with pool.connection() as conn:
+            if schema_version(conn) < LATEST_VERSION:
+                raise RuntimeError(f"{DB_FILE} is at schema version {schema_version(conn)}, expected {LATEST_VERSION}; run `flask --app app migrate` first")
+
+    # NEW: Prime the in-memory live state so read endpoints never touch the DB
+    with pool.connection() as conn:
+        live.load(conn)
+
+    backend = make_backend(STATE_BACKEND, pool)
+    # NEW: Sensor events are written in batches by a background thread
+    ingest = IngestQueue(pool, window=INGEST_WINDOW_MS / 1000, batch_max=INGEST_BATCH_MAX, on_exit=INGEST_ON_EXIT, notify=backend.notify)
+    ingest.on_commit = after_ingest
+    atexit.register(ingest.shutdown)
+    backend.start(apply_shared_changes)
+    if metrics:
+        metrics.gauge('seatidle_state_version', 'Live state version in this worker.', lambda: live.version)
+        metrics.gauge('seatidle_ingest_queue_depth', 'Sensor events waiting for the batch writer.', ingest.pending)
+        metrics.gauge('seatidle_sse_subscribers', 'Open live-update streams in this worker.', broker.subscriber_count)
+        metrics.gauge('seatidle_db_pool_idle', 'Idle pooled SQLite connections.', pool.idle_count)
+        metrics.gauge('seatidle_auth_pending', 'Logins/registrations waiting on password hashing.', hasher.pending)
+        metrics.gauge('seatidle_devices_online', 'Door units seen within the online window.', lambda: sum(d['online'] for d in live.devices.summary()))
+    _app_ready = True
+    return app
+
+def after_ingest(topics):
+    # Staff scans get their roster version once the batch is in staff_changes
+    if 'staff' in topics:
+        with pool.connection() as conn:
+            live.sync_roster(conn)
+    drain_deferred()
+
+# NEW: Another worker changed something; reload that part and tell our own live pages.
+# While our own sensor events wait in the ingest queue, our seats and staff are newer in
+# memory than in the database, so those reloads wait until the queue has drained. Deferring
+# and draining both check busy() under _deferred_lock, so no topic is left behind between them.
+_deferred_topics = set()
+_deferred_lock = threading.Lock()
+
+def apply_shared_changes(topics):
+    held = topics & {'seats', 'staff'}
+    if held:
+        with _deferred_lock:
+            if ingest.busy():
+                _deferred_topics.update(held)
+                topics = topics - held
+    if topics: reload_shared(topics)
+
+def drain_deferred():
+    with _deferred_lock:
+        if ingest.busy() or not _deferred_topics: return
+        deferred = set(_deferred_topics)
+        _deferred_topics.clear()
+    reload_shared(deferred)
+
+def reload_shared(topics):
+    with pool.connection() as conn:
+        if 'seats' in topics: live.refresh_seats(conn)
+        if 'staff' in topics: live.refresh_staff(conn)
+        if 'reservations' in topics: live.refresh_reservations(conn)
+        if 'announcement' in topics: live.refresh_announcement(conn)
+        if 'devices' in topics: live.devices.merge(tuple(r) for r in conn.execute('SELECT id, last_seen_ts, zone_id FROM devices'))
+    changed = ['stats']
+    if 'staff' in topics: changed.append('staff')
+    if 'reservations' in topics: changed.append('reservations')
+    publish_changes(*changed)
 
 # --- HELPER FUNCTIONS ---
-def get_seats():
-    with sqlite3.connect(DB_FILE) as conn:
-        return conn.execute('SELECT available_seats FROM status WHERE id=1').fetchone()[0]
+# NEW: Which door unit is talking to us (X-Device-Id header, or a 'device' field/param); None if the id
+# isn't a plain name, as it ends up in the admin panel
+DEVICE_ID = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+
+def current_device():
+    data = request.get_json(force=True, silent=True) if request.method == 'POST' else None
+    device = request.headers.get('X-Device-Id') or (data.get('device') if isinstance(data, dict) else None) or request.args.get('device')
+    if not device: return DEFAULT_DEVICE
+    return str(device) if DEVICE_ID.fullmatch(str(device)) else None
+
+# NEW: Which zone (reading room) the door unit is in: X-Zone-Id header, or a 'zone' field/param; zone 1 if
+# it doesn't say. None for a zone we don't know.
+def device_zone():
+    data = request.get_json(force=True, silent=True) if request.method == 'POST' else None
+    value = request.headers.get('X-Zone-Id') or (data.get('zone') if isinstance(data, dict) else None) or request.args.get('zone')
+    return live.zone(DEFAULT_ZONE if value is None else parse_zone_id(value))
 
-def get_total_capacity():
-    with sqlite3.connect(DB_FILE) as conn:
-        row = conn.execute('SELECT value FROM settings WHERE key="total_capacity"').fetchone()
-        return int(row[0]) if row else 50
+# NEW: Pages and APIs take ?zone=<id>; without it they show the whole campus
+def page_zone():
+    if not request.args.get('zone'): return None
+    zone = live.zone(parse_zone_id(request.args['zone']))
+    if zone is None: abort(404)
+    return zone.id
 
-# NEW: Automatically stamps the time the ESP32 last talked to the server
+# NEW: Automatically stamps the time the ESP32 last talked to the server (in memory only); returns its zone
 def update_last_ping():
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', ('last_ping', get_sl_time()))
+    zone, device = device_zone(), current_device()
+    if zone and device: live.devices.beat(device, zone.id)
+    return zone
 
-# NEW: Automatically calculates if the ESP32 has pinged within the last 65 seconds
+# Heartbeats reach the DB only on online/offline flips, zone moves or every HEARTBEAT_PERSIST_SECONDS
+def persist_heartbeat(device_id, last_seen, online, zone_id):
+    last_seen_text = get_sl_time(last_seen)
+    with pool.connection() as conn:
+        conn.execute('INSERT OR REPLACE INTO devices (id, last_seen, last_seen_ts, online, zone_id) VALUES (?, ?, ?, ?, ?)',
+                     (device_id, last_seen_text, last_seen, 1 if online else 0, zone_id))
+        backend.notify(conn, 'devices')
+
+# A device pushed out of the full registry is dropped from the table too, or it would come back on restart
+def forget_device(device_id):
+    with pool.connection() as conn:
+        conn.execute('DELETE FROM devices WHERE id = ?', (device_id,))
+
+live.devices.persist_interval = HEARTBEAT_PERSIST_SECONDS
+live.devices.persist = persist_heartbeat
+live.devices.forget = forget_device
+
+# NEW: Device endpoints answer with the error themselves; still log it and count it in /metrics
+def report_error():
+    app.logger.exception("%s %s failed", request.method, request.path)
+    if metrics: metrics.exceptions.inc((current_route(),))
+
+# NEW: Online if any ESP32 has pinged within the last 65 seconds (answered from memory)
 def get_system_status():
-    try:
-        with sqlite3.connect(DB_FILE) as conn:
-            row = conn.execute('SELECT value FROM settings WHERE key="last_ping"').fetchone()
-            if row:
-                last_ping = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
-                now = datetime.strptime(get_sl_time(), "%Y-%m-%d %H:%M:%S")
-                if (now - last_ping).total_seconds() <= 65: 
-                    return 1 # Online!
-    except:
-        pass
-    return 0 # Offline!
+    return live.system_status()
+
+# --- CONDITIONAL GET ---
+# Every polled endpoint is rendered at most once per live.version and shared by
+# everyone polling it. The ETag is a hash of that body rather than the version
+# itself, because each worker process counts versions on its own; a client that
+# already has the body gets a bodiless 304 from any worker. Filtered/paged
+# tables are keyed by their query args too, so the cache is capped (LRU).
+# Bodies are kept as snapshots.Snapshot, which also holds the gzip/brotli
+# copies, so compressed responses cost nothing extra after the first.
+RENDER_CACHE_SIZE = 256
+_render_cache = OrderedDict()  # key -> Snapshot
+_render_lock = threading.Lock()
+
+def current_version():
+    live.devices.sweep() # An online/offline flip bumps the version, so check before comparing
+    return live.version
+
+def not_modified(etag):
+    return bool(request.if_none_match) and request.if_none_match.contains(etag)
+
+def cached_render(key, version, render):
+    with _render_lock:
+        hit = _render_cache.get(key)
+        if hit and hit.version == version:
+            _render_cache.move_to_end(key)
+            return hit
+    snapshot = Snapshot(version, render())
+    with _render_lock:
+        _render_cache[key] = snapshot
+        _render_cache.move_to_end(key)
+        while len(_render_cache) > RENDER_CACHE_SIZE: _render_cache.popitem(last=False)
+    return snapshot
+
+def versioned_response(key, render, mimetype='text/html'):
+    version = current_version()
+    snapshot = cached_render(key, version, render)
+    encoding = pick_encoding(request.accept_encodings, len(snapshot.body))
+    body, etag = snapshot.encoded(encoding)
+    if not_modified(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+        if encoding != 'identity': response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.headers['X-State-Version'] = str(version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# --- BACKGROUND JOBS ---
+_jobs_started = False
+
+# NEW: Started on the first request rather than at import, so WSGI servers that fork don't inherit threads
+@app.before_request
+def start_background_jobs():
+    global _jobs_started
+    if _jobs_started: return
+    _jobs_started = True
+    if RETENTION_INTERVAL_HOURS > 0:
+        threading.Thread(target=run_retention, name='log-retention', daemon=True).start()
+    threading.Thread(target=run_slot_sweeper, name='slot-sweeper', daemon=True).start()
+
+def run_retention():
+    while True:
+        time.sleep(RETENTION_INTERVAL_HOURS * 3600)
+        try:
+            ingest.flush()
+            retention.compact(pool, LOG_RETENTION_DAYS, ARCHIVE_DIR)
+        except Exception:
+            app.logger.exception("Log retention run failed")
+
+# NEW: Bookings nobody checked in for are expired (is_used = 2) once their slot is over
+def expire_no_shows():
+    now = datetime.now(SL_TZ)
+    today = now.strftime("%Y-%m-%d")
+    ended = slots.ended_slots(now)
+    with pool.connection() as conn:
+        expired = conn.execute(f'UPDATE reservations SET is_used = 2 WHERE is_used = 0 AND (res_date < ? OR (res_date = ? AND time_slot IN ({",".join("?" * len(ended))})))',
+                               (today, today, *ended)).rowcount
+        if expired: backend.notify(conn, 'reservations')
+    if expired:
+        with pool.connection() as conn:
+            live.refresh_reservations(conn)
+    return expired
+
+def run_slot_sweeper():
+    current = None
+    while True:
+        try:
+            expired = expire_no_shows()
+            slot = (datetime.now(SL_TZ).date(), slots.current_slot(datetime.now(SL_TZ)))
+            if slot != current: live.bump() # The dashboard's held seats come from the new slot now
+            if expired or slot != current: publish_changes('stats', 'reservations')
+            current = slot
+        except Exception:
+            app.logger.exception("Slot sweep failed")
+        time.sleep(SLOT_SWEEP_SECONDS)
+
+# --- LIVE PUSH HELPERS ---
+broker = EventBroker(max_subscribers=SSE_MAX_SUBSCRIBERS)
+
+def stats_payload(zone_id=None):
+    # Campus numbers with every zone's (and the devices) alongside, so zone pages and the admin panel share
+    # one event; with zone_id, just the campus totals and that zone
+    if zone_id is not None: return live.pushed_stats(zone_id)
+    stats = live.dashboard_stats()
+    stats.update(available_seats=live.available_seats)
+    return stats
+
+# NEW: Tell every open page what changed ('stats', 'staff' and/or 'reservations'). Pass the zone when only
+# one zone's numbers moved. The payload is only built if a page is listening.
+def publish_changes(*topics, zone_id=None):
+    for topic in topics:
+        broker.publish(topic, (lambda: stats_payload(zone_id)) if topic == 'stats' else None)
+
+def on_devices_change():
+    live.bump()
+    publish_changes('stats')
+
+live.devices.on_change = on_devices_change
+
+# Devices go offline with time, not with a request, so one thread sweeps for it
+_status_watcher = None
+
+def start_status_watcher():
+    global _status_watcher
+    if _status_watcher: return
+    def watch():
+        while True:
+            time.sleep(1)
+            live.devices.sweep()
+    _status_watcher = threading.Thread(target=watch, name='status-watcher', daemon=True)
+    _status_watcher.start()
 
 # --- PUBLIC ROUTES ---
 @app.route('/')
 def dashboard():
-    total = get_total_capacity()
-    system_status = get_system_status()
-    
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        row = conn.execute('SELECT message, created_at FROM announcements ORDER BY id DESC LIMIT 1').fetchone()
-        announcement = row[0] if row else None
-        ann_time = row[1] if row else None
-        staff_count = conn.execute('SELECT count(*) FROM staff WHERE is_present = 1').fetchone()[0]
-        
-        # Grab the active reservations first
-        res_count = conn.execute('SELECT count(*) FROM reservations WHERE is_used = 0').fetchone()[0]
-
-    # --- THE NEW MATH ---
-    # 1. Figure out exactly how many people are physically inside
-    occupancy = max(0, total - get_seats()) 
-    
-    # 2. True Available Seats = Capacity - People Inside - Reservations
-    seats = max(0, total - occupancy - res_count)
+    zone_id = page_zone()
+    # NEW: Everyone who isn't signed in gets the same page, so it's rendered once per version (lobby screens, shared links)
+    if 'user_id' in session: return render_dashboard(zone_id)
+    return versioned_response(('dashboard_page', zone_id), lambda: render_dashboard(zone_id))
 
-    return render_template('dashboard.html', seats=seats, announcement=announcement, ann_time=ann_time, 
-                           system_status=system_status, occupancy=occupancy, 
-                           staff_count=staff_count, res_count=res_count)
+def render_dashboard(zone_id):
+    stats = live.dashboard_stats(zone_id)
+    return render_template('dashboard.html', seats=stats['seats'], announcement=stats['announcement'], ann_time=stats['announcement_time'], 
+                           system_status=stats['system_status'], occupancy=stats['occupancy'], 
+                           staff_count=stats['staff'], res_count=stats['reservations'], zone=stats['zone'], zones=live.zone_list())
 
 # --- AUTH ROUTES ---
+# NEW: Password hashing runs on `hasher`'s own threads behind per-IP/per-username rate limits (auth.py)
+def auth_refused(template, error, retry_after, status):
+    response = Response(render_template(template, error=error), status=status, mimetype='text/html')
+    response.headers['Retry-After'] = str(max(1, round(retry_after)))
+    return response
+
+def rate_limited(*checks):
+    # Seconds to wait if any (limiter, key) is out of attempts, else 0
+    return max(limiter.take(key) for limiter, key in checks)
+
+def save_rehash(user_id, old_hash):
+    def save(new_hash):
+        with pool.connection() as conn:
+            conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?', (new_hash, user_id, old_hash))
+    return save
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     error = None
     if request.method == 'POST':
         username = request.form.get('username')
-        password = request.form.get('password')
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
+        password = request.form.get('password') or ''
+        # Every attempt counts against the IP; only wrong passwords count against the username, and only
+        # from that IP, so nobody elsewhere can lock an account (admin included) by failing on purpose
+        user_key = ((username or '').lower(), request.remote_addr)
+        wait = max(user_limiter.wait(user_key), rate_limited((ip_limiter, request.remote_addr)))
+        if wait: return auth_refused('login.html', "⏳ Too many attempts, please wait a minute and try again.", wait, 429)
+        with get_db() as conn:
             user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-            if user and check_password_hash(user['password'], password):
-                session['user_id'] = user['id']
-                session['username'] = user['username']
-                session['role'] = user['role']
-                if user['role'] == 'admin': return redirect(url_for('admin_panel'))
-                else: return redirect(url_for('reservations_view'))
-            else:
-                error = "❌ Invalid Username or Password"
+        try:
+            valid = hasher.check(user['password'] if user else None, password)
+        except AuthBusy as e:
+            return auth_refused('login.html', "⏳ Lots of people are signing in right now, please try again in a moment.", e.retry_after, 503)
+        if valid:
+            user_limiter.reset(user_key)
+            if hasher.needs_rehash(user['password']): hasher.rehash_later(password, save_rehash(user['id'], user['password']))
+            session['user_id'] = user['id']
+            session['username'] = user['username']
+            session['role'] = user['role']
+            if user['role'] == 'admin': return redirect(url_for('admin_panel'))
+            else: return redirect(url_for('reservations_view'))
+        else:
+            user_limiter.take(user_key)
+            error = "❌ Invalid Username or Password"
     return render_template('login.html', error=error)
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -130,11 +447,15 @@ def register():
         if password != confirm_password:
             error = "❌ Passwords do not match!"
         else:
+            wait = rate_limited((ip_limiter, request.remote_addr))
+            if wait: return auth_refused('register.html', "⏳ Too many attempts, please wait a minute and try again.", wait, 429)
             try:
-                hashed_pw = generate_password_hash(password)
-                with sqlite3.connect(DB_FILE) as conn:
+                hashed_pw = hasher.hash(password)
+                with get_db() as conn:
                     conn.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)', (username, hashed_pw, 'student'))
                 return redirect(url_for('login'))
+            except AuthBusy as e:
+                return auth_refused('register.html', "⏳ Lots of people are signing in right now, please try again in a moment.", e.retry_after, 503)
             except sqlite3.IntegrityError:
                 error = "❌ Username already exists!"
     return render_template('register.html', error=error)
@@ -155,84 +476,180 @@ def reservations_view():
             name = session['username'] 
             date = request.form.get('date')
             time = request.form.get('time')
-            new_otp = str(random.randint(1000, 9999))
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.execute('INSERT INTO reservations (otp, name, res_date, time_slot, created_at, is_used, user_id) VALUES (?, ?, ?, ?, ?, 0, ?)', 
-                             (new_otp, name, date, time, get_sl_time(), session['user_id']))
+            zone = live.zone(parse_zone_id(request.form.get('zone', DEFAULT_ZONE)))
+            if zone is None:
+                message = "❌ Pick a reading room."
+            elif not slots.is_open(date, time, datetime.now(SL_TZ)):
+                message = "❌ Pick a slot that hasn't ended yet."
+            elif not live.hold_seat(zone.id, date, time, SLOT_CAPACITY or zone.total_capacity):
+                message = "❌ That slot is fully booked."
+            else:
+                new_otp, message = book_seat(name, zone.id, date, time, SLOT_CAPACITY or zone.total_capacity)
+                if new_otp: publish_changes('stats', 'reservations', zone_id=zone.id)
         elif 'cancel_booking' in request.form:
             otp = request.form.get('otp_check')
-            with sqlite3.connect(DB_FILE) as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM reservations WHERE otp = ? AND user_id = ? AND is_used = 0', (otp, session['user_id']))
-                if cursor.fetchone():
-                    cursor.execute('DELETE FROM reservations WHERE otp = ?', (otp,))
-                    conn.commit()
-                    message = "✅ Reservation cancelled successfully."
-                else: message = "❌ Invalid OTP or not your booking."
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        my_bookings = conn.execute('SELECT * FROM reservations WHERE user_id = ? AND is_used = 0 ORDER BY created_at DESC', (session['user_id'],)).fetchall()
-    return render_template('reservations.html', bookings=my_bookings, new_otp=new_otp, message=message, username=session['username'])
+            with get_db() as conn:
+                cancelled = conn.execute('DELETE FROM reservations WHERE otp = ? AND user_id = ? AND is_used = 0 RETURNING res_date, time_slot, zone_id', (otp, session['user_id'])).fetchone()
+                if cancelled: backend.notify(conn, 'reservations')
+            if cancelled:
+                live.release_booking(cancelled['zone_id'], cancelled['res_date'], cancelled['time_slot'], otp)
+                publish_changes('stats', 'reservations', zone_id=cancelled['zone_id'])
+                message = "✅ Reservation cancelled successfully."
+            else: message = "❌ Invalid OTP or not your booking."
+    with get_db() as conn:
+        my_bookings = conn.execute('SELECT * FROM reservations WHERE user_id = ? AND is_used = 0 ORDER BY created_ts DESC', (session['user_id'],)).fetchall()
+    return render_template('reservations.html', bookings=my_bookings, new_otp=new_otp, message=message, username=session['username'], slots=slots.SLOTS,
+                           zones=live.zone_list())
+
+# Saves a booking whose seat is already held here; returns (otp, None) or (None, error message).
+# The slot count is checked again in the INSERT itself, as other workers book too.
+def book_seat(name, zone_id, date, time_slot, limit):
+    error = "❌ No booking codes left right now, please try again later."
+    for _ in range(5):
+        new_otp = live.otps.issue()
+        if new_otp is None: break
+        try:
+            now = int(time.time())
+            with get_db() as conn:
+                saved = conn.execute('''INSERT INTO reservations (otp, name, res_date, time_slot, created_at, created_ts, is_used, user_id, zone_id)
+                    SELECT ?, ?, ?, ?, ?, ?, 0, ?, ? WHERE (SELECT count(*) FROM reservations WHERE res_date = ? AND time_slot = ? AND zone_id = ? AND is_used = 0) < ?''',
+                    (new_otp, name, date, time_slot, get_sl_time(now), now, session['user_id'], zone_id, date, time_slot, zone_id, limit)).rowcount
+                if saved: backend.notify(conn, 'reservations')
+            if saved:
+                live.bump() # The hold bumped the version before the row existed; pages cached in between are stale
+                return new_otp, None
+            live.otps.release(new_otp)
+            error = "❌ That slot is fully booked."
+            break
+        except sqlite3.IntegrityError:
+            pass # Another process handed out this code first; it stays out of our pool
+        except Exception:
+            live.release_booking(zone_id, date, time_slot, new_otp)
+            raise
+    live.release_booking(zone_id, date, time_slot)
+    return None, error
 
 # --- ADMIN PANEL ---
 @app.route('/admin/panel', methods=['GET', 'POST'])
 def admin_panel():
     if session.get('role') != 'admin': return redirect(url_for('login'))
     msg = None
+    changed = ()
     if request.method == 'POST':
+        ingest.flush() # Queued sensor batches must not land on top of an admin change
+        zone = live.zone(parse_zone_id(request.form.get('zone_id', DEFAULT_ZONE))) # for the per-zone seat forms
         if 'post_announcement' in request.form:
             text = request.form.get('message')
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.execute('INSERT INTO announcements (message, created_at) VALUES (?, ?)', (text, get_sl_time()))
+            created_at = get_sl_time()
+            with get_db() as conn:
+                conn.execute('INSERT INTO announcements (message, created_at) VALUES (?, ?)', (text, created_at))
+                backend.notify(conn, 'announcement')
+            live.set_announcement(text, created_at)
+            changed = ('stats',)
             msg = "📢 Announcement Posted"
         elif 'delete_announcement' in request.form:
             ann_id = request.form.get('ann_id')
-            with sqlite3.connect(DB_FILE) as conn:
+            with get_db() as conn:
                 conn.execute('DELETE FROM announcements WHERE id = ?', (ann_id,))
+                backend.notify(conn, 'announcement')
+                live.refresh_announcement(conn)
+            changed = ('stats',)
             msg = "🗑️ Announcement Deleted"
+        elif ('reset_seats' in request.form or 'update_capacity' in request.form) and zone is None:
+            msg = "❌ Unknown zone."
         elif 'reset_seats' in request.form:
             target = int(request.form.get('seat_count'))
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.execute('UPDATE status SET available_seats = ? WHERE id=1', (target,))
-            msg = f"✅ Seats reset to {target}"
+            with get_db() as conn:
+                conn.execute('UPDATE zones SET available_seats = ? WHERE id = ?', (target, zone.id))
+                backend.notify(conn, 'seats')
+            live.set_seats(target, zone.id)
+            changed = ('stats',)
+            msg = f"✅ {zone.name}: seats reset to {target}"
         elif 'update_capacity' in request.form:
             new_total = int(request.form.get('total_capacity'))
-            current_seats = get_seats()
-            old_total = get_total_capacity()
-            people_inside = max(0, old_total - current_seats)
+            people_inside = max(0, zone.total_capacity - zone.available_seats)
             new_available = max(0, new_total - people_inside)
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.execute('UPDATE settings SET value = ? WHERE key="total_capacity"', (new_total,))
-                conn.execute('UPDATE status SET available_seats = ? WHERE id=1', (new_available,))
-            msg = f"✅ Capacity updated to {new_total}. (Occupancy: {people_inside})"
+            with get_db() as conn:
+                conn.execute('UPDATE zones SET total_capacity = ?, available_seats = ? WHERE id = ?', (new_total, new_available, zone.id))
+                backend.notify(conn, 'seats')
+            live.set_capacity(new_total, new_available, zone.id)
+            changed = ('stats',)
+            msg = f"✅ {zone.name}: capacity updated to {new_total}. (Occupancy: {people_inside})"
+        elif 'add_zone' in request.form:
+            name = (request.form.get('zone_name') or '').strip()
+            total = int(request.form.get('zone_capacity'))
+            try:
+                with get_db() as conn:
+                    zone_id = conn.execute('INSERT INTO zones (name, total_capacity, available_seats) VALUES (?, ?, ?) RETURNING id', (name, total, total)).fetchone()[0]
+                    backend.notify(conn, 'seats')
+                live.add_zone(zone_id, name, total, total)
+                changed = ('stats',)
+                msg = f"✅ Added zone {name} (id {zone_id}); its door units send X-Zone-Id: {zone_id}"
+            except sqlite3.IntegrityError:
+                msg = "❌ A zone with that name already exists."
         elif 'delete_staff' in request.form:
             uid = request.form.get('staff_uid')
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.execute('DELETE FROM staff WHERE uid = ?', (uid,))
+            with get_db() as conn:
+                if conn.execute('DELETE FROM staff WHERE uid = ?', (uid,)).rowcount:
+                    save_roster_changes(conn, [(uid, None)])
+                    backend.notify(conn, 'staff')
+            live.remove_staff(uid)
+            live.sync_roster(get_db())
+            changed = ('stats', 'staff')
             msg = "🗑️ Staff deleted."
         elif 'add_staff' in request.form:
             uid = request.form.get('new_uid')
             name = request.form.get('new_name')
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.execute('INSERT OR REPLACE INTO staff (uid, name, is_present, last_seen) VALUES (?, ?, 0, ?)', (uid, name, get_sl_time()))
+            now = get_sl_time()
+            with get_db() as conn:
+                conn.execute('INSERT OR REPLACE INTO staff (uid, name, is_present, last_seen) VALUES (?, ?, 0, ?)', (uid, name, now))
+                save_roster_changes(conn, [(uid, 0)])
+                backend.notify(conn, 'staff')
+            live.upsert_staff(uid, name, 0, now)
+            live.sync_roster(get_db())
+            changed = ('staff',)
             msg = f"✅ Added {name}"
         elif 'delete_res' in request.form:
-            otp = request.form.get('res_otp')
-            with sqlite3.connect(DB_FILE) as conn:
-                conn.execute('DELETE FROM reservations WHERE otp = ?', (otp,))
+            res_id = request.form.get('res_id')
+            with get_db() as conn:
+                conn.execute('DELETE FROM reservations WHERE id = ?', (res_id,))
+                backend.notify(conn, 'reservations')
+            live.refresh_reservations(get_db()) # After the commit, so the new version never shows old rows
+            changed = ('stats', 'reservations')
             msg = "🗑️ Reservation deleted."
+        publish_changes(*changed)
 
-    seats = get_seats()
-    total_capacity = get_total_capacity() 
+    seats = live.available_seats
+    total_capacity = live.total_capacity
     system_status = get_system_status() 
 
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        all_staff = conn.execute('SELECT * FROM staff').fetchall()
-        all_reservations = conn.execute('SELECT * FROM reservations ORDER BY created_at DESC').fetchall()
-        all_announcements = conn.execute('SELECT * FROM announcements ORDER BY id DESC').fetchall()
+    with get_db() as conn:
+        recent_announcements = conn.execute('SELECT * FROM announcements ORDER BY id DESC LIMIT ?', (ANNOUNCEMENTS_SHOWN,)).fetchall()
+
+    return render_template('admin_panel.html', seats=seats, total_capacity=total_capacity, announcements=recent_announcements, msg=msg, system_status=system_status,
+                           zones=live.admin_stats()['zones'], slots=slots.SLOTS, statuses=pages.RES_STATUS, **staff_table(), **reservations_table())
+
+# NEW: One page of each admin table, from the query string (shared by the full page and the polled partials)
+def staff_table():
+    filters = pages.staff_filters(request.args)
+    after = request.args.get('staff_after') or None
+    staff, next_after = pages.staff_page(live.all_staff(), filters, after)
+    return dict(staff=staff, staff_next=next_after, staff_paged=after is not None)
 
-    return render_template('admin_panel.html', seats=seats, total_capacity=total_capacity, staff=all_staff, reservations=all_reservations, announcements=all_announcements, msg=msg, system_status=system_status)
+def reservations_table():
+    filters = pages.reservation_filters(request.args)
+    before = pages.int_arg(request.args.get('before'))
+    reservations, next_before = pages.reservations_page(get_db(), filters, before)
+    zone_names = {z['id']: z['name'] for z in live.zone_list()}
+    return dict(reservations=reservations, res_next=next_before, res_paged=before is not None, zone_names=zone_names if len(zone_names) > 1 else {})
+
+@app.template_global()
+def page_url(endpoint, **changes):
+    # The current URL's table args (pages.QUERY_ARGS) with some replaced (None drops one); others are
+    # left out, as cached table fragments aren't keyed by them
+    args = {k: v for k, v in request.args.items() if k in pages.QUERY_ARGS}
+    args.update(changes)
+    return url_for(endpoint, **{k: v for k, v in args.items() if v not in (None, '')})
 
 @app.route('/admin/users', methods=['GET', 'POST'])
 def admin_users():
@@ -241,60 +658,84 @@ def admin_users():
     if request.method == 'POST':
         if 'delete_user' in request.form:
             user_id = request.form.get('user_id')
-            with sqlite3.connect(DB_FILE) as conn:
+            with get_db() as conn:
                 conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
             msg = "🗑️ User Account Deleted"
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        all_users = conn.execute('SELECT * FROM users ORDER BY id DESC').fetchall()
-    return render_template('admin_users.html', users=all_users, msg=msg)
+    filters = pages.user_filters(request.args)
+    before = pages.int_arg(request.args.get('before'))
+    with get_db() as conn:
+        users, next_before = pages.users_page(conn, filters, before)
+        total_users = conn.execute('SELECT count(*) FROM users').fetchone()[0]
+    return render_template('admin_users.html', users=users, next_before=next_before, paged=before is not None,
+                           total_users=total_users, filters=filters, roles=pages.USER_ROLES, msg=msg)
+
+# NEW: CSV exports, streamed a chunk at a time so memory doesn't grow with the table
+@app.route('/admin/export/reservations.csv')
+def export_reservations():
+    if session.get('role') != 'admin': return redirect(url_for('login'))
+    chunks = pages.walk(pool, pages.reservations_page, pages.reservation_filters(request.args))
+    columns = ('id', 'zone_id', 'res_date', 'time_slot', 'name', 'otp', 'is_used', 'created_at', 'user_id')
+    return csv_response(pages.stream_csv(columns, chunks), 'reservations.csv')
+
+@app.route('/admin/export/users.csv')
+def export_users():
+    if session.get('role') != 'admin': return redirect(url_for('login'))
+    chunks = pages.walk(pool, pages.users_page, pages.user_filters(request.args))
+    return csv_response(pages.stream_csv(('id', 'username', 'role'), chunks), 'users.csv')
+
+def csv_response(body, filename):
+    return Response(body, mimetype='text/csv', headers={'Content-Disposition': f'attachment; filename={filename}', 'Cache-Control': 'no-store'})
 
 @app.route('/admin/edit_staff/<uid>', methods=['GET', 'POST'])
 def edit_staff(uid):
     if session.get('role') != 'admin': return redirect(url_for('login'))
     if request.method == 'POST':
         new_name = request.form.get('name')
-        with sqlite3.connect(DB_FILE) as conn:
+        with get_db() as conn:
             conn.execute('UPDATE staff SET name = ? WHERE uid = ?', (new_name, uid))
+            backend.notify(conn, 'staff')
+        live.rename_staff(uid, new_name)
+        publish_changes('staff')
         return redirect(url_for('admin_panel'))
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_db() as conn:
         person = conn.execute('SELECT * FROM staff WHERE uid = ?', (uid,)).fetchone()
     if not person: return "Staff member not found", 404
     return render_template('edit_staff.html', person=person)
 
 @app.route('/staff')
 def staff_view():
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        active_staff = conn.execute('SELECT * FROM staff WHERE is_present = 1').fetchall()
-    return render_template('staff.html', staff=active_staff)
+    return render_template('staff.html', staff=live.present_staff())
 
 # --- API ROUTES ---
 
 # NEW: The dedicated heartbeat endpoint for the ESP32
 @app.route('/ping', methods=['GET'])
 def ping():
-    update_last_ping()
+    if current_device() is None: return "Invalid device id", 400
+    if update_last_ping() is None: return "Unknown zone", 400
     return "OK", 200
 
 @app.route('/get_staff', methods=['GET'])
 def get_staff():
+    # NEW: Devices that send ?since=<roster version> get "<version>|D|uid:1,uid:-,..."
+    # (only what changed, "-" = card removed) or "<version>|F|<full list>" when they
+    # are too far behind. Without `since` it's the old full "uid:is_present,..." list.
     try:
         update_last_ping() # Syncing counts as a heartbeat!
-        with sqlite3.connect(DB_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT uid, is_present FROM staff')
-            rows = cursor.fetchall()
-            staff_cards = [f"{row[0]}:{row[1]}" for row in rows]
-            return ",".join(staff_cards), 200
+        since = request.args.get('since', type=int)
+        if since is None:
+            return live.roster_snapshot(), 200, {'X-Roster-Version': str(live.roster_version)}
+        version, full, body = live.roster_changes(since)
+        return f"{version}|{'F' if full else 'D'}|{body}", 200, {'X-Roster-Version': str(version)}
     except Exception as e:
+        report_error()
         return str(e), 500
 
 @app.route('/update_data', methods=['POST'])
 def update_data():
     try:
-        update_last_ping() # Sending data counts as a heartbeat!
+        zone = update_last_ping() # Sending data counts as a heartbeat!
+        if zone is None: return jsonify({"status": "error", "message": "Unknown zone"}), 400
         data = request.get_json(force=True, silent=True)
         if not data: return jsonify({"status": "error", "message": "No JSON data"}), 400
         
@@ -303,114 +744,197 @@ def update_data():
         user = data.get('user', "STUDENT")
         uid = data.get('uid', "")
         
-        now = get_sl_time()
-        total_limit = get_total_capacity() 
+        now_ts = time.time()
+        now = get_sl_time(now_ts)
+        total_limit = zone.total_capacity # occupancy is counted per zone, by that zone's doors
+        record = {'timestamp': now, 'ts': now_ts, 'event_type': event, 'occupancy': max(0, occupancy), 'zone': zone.id}
         
-        with sqlite3.connect(DB_FILE) as conn:
-            cursor = conn.cursor()
-            if uid != "":
-                is_present = 1 if event == "ENTRY" else 0
-                cursor.execute('UPDATE staff SET is_present = ?, last_seen = ? WHERE uid = ?', (is_present, now, uid))
-                cursor.execute('SELECT name FROM staff WHERE uid = ?', (uid,))
-                if cursor.fetchone(): user = "STAFF"
-            
-            if user != "STAFF":
-                safe_occ = max(0, occupancy) 
-                new_available = max(0, total_limit - safe_occ)
-                cursor.execute('UPDATE status SET available_seats = ? WHERE id=1', (new_available,))
-            
-            cursor.execute("INSERT INTO logs (timestamp, event_type, user_type, occupancy) VALUES (?, ?, ?, ?)", (now, event, user, max(0, occupancy)))
-            conn.commit()
+        # Live state changes now; the database catches up in the next batch
+        if uid != "":
+            is_present = 1 if event == "ENTRY" else 0
+            if live.set_staff_presence(uid, is_present, now):
+                user = "STAFF"
+                record['staff'] = (uid, is_present)
+                publish_changes('staff')
+        
+        if user != "STAFF":
+            safe_occ = max(0, occupancy) 
+            new_available = max(0, total_limit - safe_occ)
+            live.set_seats(new_available, zone.id)
+            record['seats'] = new_available
+        
+        record['user_type'] = user
+        if INGEST_MODE == 'sync':
+            ingest.committed(ingest.write([record]))
+        else:
+            ingest.submit(record)
+        publish_changes('stats', zone_id=zone.id)
             
         return jsonify({"status": "success"}), 200
     except Exception as e:
+        report_error()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/dashboard_stats')
 def get_dashboard_stats():
-    total = get_total_capacity()
-    system_status = get_system_status()
-    
-    with sqlite3.connect(DB_FILE) as conn:
-        staff_count = conn.execute('SELECT count(*) FROM staff WHERE is_present = 1').fetchone()[0]
-        res_count = conn.execute('SELECT count(*) FROM reservations WHERE is_used = 0').fetchone()[0]
-        row = conn.execute('SELECT message, created_at FROM announcements ORDER BY id DESC LIMIT 1').fetchone()
-        announcement = row[0] if row else None
-        ann_time = row[1] if row else None
-
-    # 1. Figure out exact physical occupancy
-    occupancy = max(0, total - get_seats()) 
-    
-    # 2. True Available Seats = Capacity - People Inside - Reservations
-    seats = max(0, total - occupancy - res_count)
-
-    return jsonify({
-        "seats": seats, 
-        "occupancy": occupancy, 
-        "staff": staff_count, 
-        "reservations": res_count,
-        "system_status": system_status, 
-        "announcement": announcement, 
-        "announcement_time": ann_time
-    })
+    zone_id = page_zone()
+    return versioned_response(('dashboard_stats', zone_id), lambda: app.json.dumps(live.dashboard_stats(zone_id)), 'application/json')
+
+# NEW: Every zone's seat numbers plus the campus totals
+@app.route('/api/zones')
+def get_zones():
+    def render():
+        campus = live.dashboard_stats()
+        zones = campus.pop('zones')
+        summary = {k: campus[k] for k in ('seats', 'occupancy', 'reservations', 'total_capacity', 'system_status')}
+        return app.json.dumps({"campus": summary, "zones": zones})
+    return versioned_response('zones', render, 'application/json')
+
+# NEW: Server-Sent Events stream that replaces the 2-second polling loops
+@app.route('/api/stream')
+def stream():
+    topics = [t for t in request.args.get('topics', 'stats').split(',') if t in ('stats', 'staff', 'reservations')]
+    sub = broker.subscribe(topics)
+    if sub is None:
+        # Worker is full; live.js falls back to polling
+        return "Too many live connections", 503, {'Retry-After': '30'}
+    start_status_watcher()
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            # Send current state first so a (re)connecting page never shows stale numbers
+            for topic in topics:
+                yield format_sse(topic, stats_payload() if topic == 'stats' else None)
+            while True:
+                events = sub.wait(SSE_KEEPALIVE)
+                if not events:
+                    yield ": keep-alive\n\n"
+                for topic, data in events:
+                    yield format_sse(topic, data)
+        finally:
+            broker.unsubscribe(sub)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# NEW: Occupancy history from the rollups, e.g. ?granularity=hour&start=2025-01-10&end=2025-01-11[&zone=2]
+@app.route('/api/occupancy_history')
+def occupancy_history():
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in rollups.GRANULARITIES:
+        return jsonify({"status": "error", "message": "granularity must be minute, hour or day"}), 400
+    zone_id = parse_zone_id(request.args.get('zone', DEFAULT_ZONE))
+    if live.zone(zone_id) is None: return jsonify({"status": "error", "message": "Unknown zone"}), 400
+    try:
+        end = rollups.parse_local(request.args['end']) if 'end' in request.args else int(time.time()) + 1
+        start = rollups.parse_local(request.args['start']) if 'start' in request.args else end - 60 * rollups.GRANULARITIES[granularity]
+        buckets = rollups.history(get_db(), granularity, start, end, zone_id)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"zone": zone_id, "granularity": granularity, "start": rollups.to_local_text(start), "end": rollups.to_local_text(end), "buckets": buckets})
 
 @app.route('/api/admin_stats')
 def get_admin_stats():
     if session.get('role') != 'admin': return jsonify({}), 403
-    seats = get_seats()
-    total = get_total_capacity()
-    status = get_system_status()
-    return jsonify({"seats": seats, "total_capacity": total, "system_status": status})
+    return versioned_response('admin_stats', lambda: app.json.dumps(live.admin_stats()), 'application/json')
 
 @app.route('/api/get_active_staff_cards')
 def get_active_staff_cards():
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        active_staff = conn.execute('SELECT * FROM staff WHERE is_present = 1').fetchall()
-    return render_template('_staff_cards.html', staff=active_staff)
+    return versioned_response('staff_cards', lambda: render_template('_staff_cards.html', staff=live.present_staff()))
 
 @app.route('/api/get_staff_table')
 def get_staff_table():
     if session.get('role') != 'admin': return "Access Denied", 403
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        all_staff = conn.execute('SELECT * FROM staff').fetchall()
-    return render_template('_staff_rows.html', staff=all_staff)
+    key = pages.panel_key('staff_rows', request.args)
+    return versioned_response(key, lambda: render_template('_staff_rows.html', **staff_table()))
 
 @app.route('/api/get_reservations_table')
 def get_reservations_table():
     if session.get('role') != 'admin': return "Access Denied", 403
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        reservations = conn.execute('SELECT * FROM reservations ORDER BY created_at DESC').fetchall()
-    return render_template('_table_rows.html', reservations=reservations)
+    key = pages.panel_key('reservation_rows', request.args)
+    return versioned_response(key, lambda: render_template('_table_rows.html', statuses=pages.RES_STATUS, **reservations_table()))
 
 # NEW: Verifies a student's OTP from the ESP32 Keypad
 @app.route('/verify_otp', methods=['POST'])
 def verify_otp():
     try:
-        update_last_ping() # Checking an OTP counts as a heartbeat!
+        zone = update_last_ping() # Checking an OTP counts as a heartbeat!
+        if zone is None: return jsonify({"status": "error", "message": "Unknown zone"}), 400
         data = request.get_json(force=True, silent=True)
         if not data: return jsonify({"status": "error"}), 400
         
-        otp = data.get('otp', "")
+        otp = str(data.get('otp', ""))
         
-        with sqlite3.connect(DB_FILE) as conn:
-            cursor = conn.cursor()
-            # Check if the OTP exists and hasn't been used yet
-            cursor.execute('SELECT * FROM reservations WHERE otp = ? AND is_used = 0', (otp,))
-            res = cursor.fetchone()
-            
-            if res:
-                # Mark it as used!
-                cursor.execute('UPDATE reservations SET is_used = 1 WHERE otp = ?', (otp,))
-                conn.commit()
-                return jsonify({"status": "success"}), 200
-            else:
-                return jsonify({"status": "error", "message": "Invalid or Used OTP"}), 400
+        # Codes no unused booking holds are turned away without touching the database
+        if not live.otps.is_active(otp):
+            return jsonify({"status": "error", "message": "Invalid or Used OTP"}), 400
+        with get_db() as conn:
+            # Check and mark as used in one step, so two keypads can't both accept it; only this zone's bookings count here
+            used = conn.execute('UPDATE reservations SET is_used = 1 WHERE otp = ? AND is_used = 0 AND zone_id = ? RETURNING res_date, time_slot', (otp, zone.id)).fetchone()
+            if used: backend.notify(conn, 'reservations')
+        if used:
+            live.release_booking(zone.id, used['res_date'], used['time_slot'], otp)
+            publish_changes('stats', 'reservations', zone_id=zone.id)
+            return jsonify({"status": "success"}), 200
+        else:
+            return jsonify({"status": "error", "message": "Invalid or Used OTP"}), 400
     except Exception as e:
+        report_error()
         return jsonify({"status": "error", "message": str(e)}), 500
     
+# NEW: Prometheus text format; open to admins, or a scraper with SEATIDLE_METRICS_TOKEN. Not to localhost:
+# behind a reverse proxy on this host every request comes from there
+@app.route('/metrics')
+def metrics_view():
+    if metrics is None: return "Metrics are turned off (SEATIDLE_METRICS=0)", 404
+    token_ok = METRICS_TOKEN and request.headers.get('Authorization') == f'Bearer {METRICS_TOKEN}'
+    if not (session.get('role') == 'admin' or token_ok):
+        return "Access Denied", 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# --- CLI ---
+# NEW: flask --app app migrate  (the plain app, not create_app: it must work on a database that isn't migrated yet)
+@app.cli.command('migrate')
+def migrate_command():
+    with pool.connection() as conn:
+        before = schema_version(conn)
+    init_db()
+    with pool.connection() as conn:
+        after = schema_version(conn)
+    print(f"✅ Schema at version {after}" + (f" (was {before})." if after != before else ", nothing to do."))
+
+# NEW: flask --app app:create_app check-query-plans  (fails if a hot query falls back to a full scan)
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    with pool.connection() as conn:
+        problems = check_query_plans(conn)
+    for sql, detail in problems:
+        print(f"❌ {detail}\n   {sql}")
+    if problems: raise SystemExit(1)
+    print("✅ All hot queries use an index.")
+
+# NEW: flask --app app:create_app rebuild-rollups  (recomputes the rollups the raw logs still cover)
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    if ingest: ingest.flush() # None under plain `--app app`: this process has no queued events then
+    with pool.connection() as conn:
+        rollups.backfill(conn)
+        count = conn.execute('SELECT count(*) FROM occupancy_rollups').fetchone()[0]
+    print(f"✅ Rebuilt {count} rollup buckets.")
+
+# NEW: flask --app app:create_app compact-logs [--vacuum]  (archive + delete raw logs past the retention window)
+@app.cli.command('compact-logs')
+@click.option('--vacuum', is_flag=True, help='Switch an older database to incremental auto-vacuum first (rewrites the file once).')
+def compact_logs_command(vacuum):
+    if vacuum: retention.convert_to_incremental_vacuum(pool)
+    if ingest: ingest.flush()
+    removed = retention.compact(pool, LOG_RETENTION_DAYS, ARCHIVE_DIR)
+    if removed is None:
+        print("⏳ Another process is already compacting.")
+    else:
+        print(f"✅ Archived {removed} log rows to {ARCHIVE_DIR}")
+
 # --- SIMULATOR ---
 @app.route('/simulator')
 def simulator():
@@ -506,4 +1030,4 @@ def simulator():
     """
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    create_app(migrate_schema=True).run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
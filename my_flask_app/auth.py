@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# --- PASSWORD HASHING ---
+# Hashing a password is deliberately slow (scrypt by default). A wave of
+# logins used to run that on every request thread at once, and the door
+# unit's /update_data and /verify_otp waited behind them. Now hashing runs on
+# a small executor of its own, and only `max_pending` requests per worker may
+# be waiting on it. The rest get "busy, retry" straight away, so most of the
+# request threads stay free for the devices. Stored hashes made with older
+# parameters are upgraded after a successful login.
+
+log = logging.getLogger(__name__)
+
+
+class AuthBusy(Exception):
+    retry_after = 2
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=2, max_pending=8):
+        self.method = method  # anything werkzeug's generate_password_hash takes, e.g. 'pbkdf2:sha256:600000'
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._params = None  # "method:params" prefix of a current hash, worked out on first use
+        self._dummy = None  # checked against for unknown usernames, so they take as long as known ones
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False): raise AuthBusy()
+        with self._pending_lock: self._pending += 1
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            with self._pending_lock: self._pending -= 1
+            self._slots.release()
+
+    def pending(self):
+        return self._pending
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, stored, password):
+        # stored may be None (unknown user): still costs one hash, then fails
+        if stored is None:
+            if self._dummy is None: self._dummy = self._run(generate_password_hash, 'unused', self.method)
+            self._run(check_password_hash, self._dummy, password)
+            return False
+        return self._run(check_password_hash, stored, password)
+
+    def needs_rehash(self, stored):
+        if self._params is None: self._params = generate_password_hash('', self.method).split('$', 1)[0]
+        return stored.split('$', 1)[0] != self._params
+
+    def rehash_later(self, password, save):
+        # After a successful login: hash again with the current parameters and hand the result to save(new_hash).
+        # Runs in the background and skips the admission limit, since the login itself already got through.
+        def work():
+            try:
+                save(generate_password_hash(password, self.method))
+            except Exception:
+                log.exception("Upgrading a password hash failed")
+        self._executor.submit(work)
+
+
+# --- RATE LIMITS ---
+# Token buckets per key (client IP, username): `burst` attempts straight
+# away, then `per_minute`. Kept per worker process and in memory, which
+# is enough to make guessing passwords slow without adding another service.
+
+class RateLimiter:
+    def __init__(self, per_minute, burst, max_keys=10000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> [tokens, monotonic of last update]
+
+    def take(self, key):
+        # 0 if allowed, otherwise the seconds until the next attempt would be
+        return self._take(key, charge=True)
+
+    def wait(self, key):
+        # Like take, but doesn't use up an attempt (for limits charged only on failures)
+        return self._take(key, charge=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def _take(self, key, charge):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if not charge: return 0
+                if len(self._buckets) >= self.max_keys: self._prune(now)
+                bucket = self._buckets[key] = [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                if charge: bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+    def _prune(self, now):
+        # Buckets that have refilled completely are the same as no bucket
+        full = [k for k, (tokens, last) in self._buckets.items() if tokens + (now - last) * self.rate >= self.burst]
+        for key in full: del self._buckets[key]
+        if len(self._buckets) >= self.max_keys: self._buckets.clear()
@@ -0,0 +1,103 @@
+"""Requests per second on the dashboard and ingest endpoints, unpooled vs pooled.
+
+    python benchmarks/bench_db.py [--seconds 5] [--readers 8] [--writers 4]
+
+Each mode runs in its own process against a fresh temporary database, with
+reader threads polling the dashboard and reservations table while writer
+threads post ESP32 events to /update_data at the same time.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {'unpooled': '0', 'pooled': '8'}  # value of SEATIDLE_DB_POOL
+READ_ENDPOINTS = ['/api/dashboard_stats', '/api/get_reservations_table']
+
+
+def run_mode(seconds, readers, writers):
+    sys.path.insert(0, APP_DIR)
+    import app as seatidle
+    seatidle.create_app(migrate_schema=True)
+
+    with seatidle.pool.connection() as conn:
+        conn.executemany('INSERT INTO reservations (otp, name, res_date, time_slot, created_at, is_used, user_id) VALUES (?, ?, ?, ?, ?, 0, 1)',
+                         [(str(1000 + i), f'student{i}', '2026-01-01', '08:00 AM - 12:00 PM', seatidle.get_sl_time()) for i in range(300)])
+
+    counts = {}
+    errors = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def record(endpoint, ok):
+        with lock:
+            bucket = counts if ok else errors
+            bucket[endpoint] = bucket.get(endpoint, 0) + 1
+
+    # One admin login shared by every reader, as the login rate limits would turn most of them away
+    login = seatidle.app.test_client()
+    login.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    admin_session = login.get_cookie('session').value
+
+    def reader():
+        client = seatidle.app.test_client()
+        client.set_cookie('session', admin_session)
+        i = 0
+        while time.perf_counter() < deadline:
+            endpoint = READ_ENDPOINTS[i % len(READ_ENDPOINTS)]
+            record(endpoint, client.get(endpoint).status_code == 200)
+            i += 1
+
+    def writer():
+        client = seatidle.app.test_client()
+        occupancy = 0
+        while time.perf_counter() < deadline:
+            occupancy = (occupancy + 1) % 50
+            response = client.post('/update_data', json={'occupancy': occupancy, 'event': 'ENTRY', 'user': 'STUDENT'})
+            record('/update_data', response.status_code == 200)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    print(json.dumps({
+        'rps': {k: round(v / seconds, 1) for k, v in counts.items()},
+        'errors': errors,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.seconds, args.readers, args.writers)
+        return
+
+    results = {}
+    for mode, pool_size in MODES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, SEATIDLE_DB=os.path.join(tmp, 'bench.db'), SEATIDLE_DB_POOL=pool_size)
+            out = subprocess.run([sys.executable, __file__, '--mode', mode, '--seconds', str(args.seconds),
+                                  '--readers', str(args.readers), '--writers', str(args.writers)],
+                                 env=env, cwd=APP_DIR, capture_output=True, text=True, check=True).stdout
+            results[mode] = json.loads(out.strip().splitlines()[-1])
+
+    endpoints = READ_ENDPOINTS + ['/update_data']
+    print(f"{'endpoint':<32}" + ''.join(f'{m + " rps":>16}' for m in MODES) + f"{'errors':>16}")
+    for endpoint in endpoints:
+        row = ''.join(f"{results[m]['rps'].get(endpoint, 0):>16}" for m in MODES)
+        errs = '/'.join(str(results[m]['errors'].get(endpoint, 0)) for m in MODES)
+        print(f'{endpoint:<32}{row}{errs:>16}')
+
+
+if __name__ == '__main__':
+    main()
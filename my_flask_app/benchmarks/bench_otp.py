@@ -0,0 +1,133 @@
+"""Booking-code issue and keypad verification latency, randint vs the allocator.
+
+    python benchmarks/bench_otp.py [--ops 40000] [--active 6000] [--typos 0.1]
+
+Each mode runs in its own process against a fresh temporary database. It
+books codes until `--active` bookings are unused, then repeatedly checks one
+in at the keypad and books a new one, so the table keeps growing while the
+number of live codes stays the same. `--typos` of the keypad attempts are
+codes nobody holds. The old way picks a code with random.randint (retrying
+on a collision) and verifies with a SELECT then an UPDATE; the new way uses
+the app's allocator, the in-memory check and one conditional UPDATE.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('randint', 'allocator')
+INSERT = 'INSERT INTO reservations (otp, name, res_date, time_slot, created_at, is_used, user_id) VALUES (?, ?, ?, ?, ?, 0, 1)'
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6, 1)
+    return {'p50_us': pick(0.5), 'p99_us': pick(0.99), 'mean_us': round(statistics.fmean(samples) * 1e6, 1)}
+
+
+def run_mode(mode, ops, active, typos):
+    sys.path.insert(0, APP_DIR)
+    import app as seatidle
+    seatidle.create_app(migrate_schema=True)
+
+    conn = seatidle.pool.acquire()
+    now = seatidle.get_sl_time()
+    retries = 0
+
+    def issue_randint():
+        nonlocal retries
+        while True:
+            code = str(random.randint(1000, 9999))
+            try:
+                with conn:
+                    conn.execute(INSERT, (code, 'bench', '2026-01-01', '08:00 AM - 12:00 PM', now))
+                return code
+            except sqlite3.IntegrityError:
+                retries += 1
+
+    def issue_allocator():
+        code = seatidle.live.otps.issue()
+        with conn:
+            conn.execute(INSERT, (code, 'bench', '2026-01-01', '08:00 AM - 12:00 PM', now))
+        return code
+
+    def verify_randint(code):
+        with conn:
+            if conn.execute('SELECT * FROM reservations WHERE otp = ? AND is_used = 0', (code,)).fetchone():
+                conn.execute('UPDATE reservations SET is_used = 1 WHERE otp = ? AND is_used = 0', (code,))
+                return True
+        return False
+
+    def verify_allocator(code):
+        # What /verify_otp does, minus the HTTP layer so both modes are timed the same way
+        if not seatidle.live.otps.is_active(code): return False
+        with conn:
+            used = conn.execute('UPDATE reservations SET is_used = 1 WHERE otp = ? AND is_used = 0', (code,)).rowcount
+        if used: seatidle.live.otps.release(code)
+        return bool(used)
+
+    issue = issue_allocator if mode == 'allocator' else issue_randint
+    verify = verify_allocator if mode == 'allocator' else verify_randint
+
+    held = [issue() for _ in range(active)]
+    issue_times, verify_times, wrong = [], [], 0
+    for _ in range(ops):
+        typo = random.random() < typos
+        if typo:
+            code = str(random.randint(1000, 9999))
+            if code in held: code = '0000'
+        else:
+            code = held.pop(random.randrange(len(held)))
+        t = time.perf_counter()
+        ok = verify(code)
+        verify_times.append(time.perf_counter() - t)
+        wrong += ok == typo
+        if typo: continue
+        t = time.perf_counter()
+        held.append(issue())
+        issue_times.append(time.perf_counter() - t)
+
+    tenth = len(verify_times) // 10
+    print(json.dumps({
+        'issue': percentiles(issue_times),
+        'verify': percentiles(verify_times),
+        'verify_first_10pct': percentiles(verify_times[:tenth]),
+        'verify_last_10pct': percentiles(verify_times[-tenth:]),
+        'collision_retries': retries,
+        'wrong_answers': wrong,
+        'rows': conn.execute('SELECT count(*) FROM reservations').fetchone()[0],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=40000)
+    parser.add_argument('--active', type=int, default=6000)
+    parser.add_argument('--typos', type=float, default=0.1)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.ops, args.active, args.typos)
+        return
+
+    results = {}
+    for mode in MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, SEATIDLE_DB=os.path.join(tmp, 'bench.db'))
+            out = subprocess.run([sys.executable, __file__, '--mode', mode, '--ops', str(args.ops),
+                                  '--active', str(args.active), '--typos', str(args.typos)],
+                                 env=env, cwd=APP_DIR, capture_output=True, text=True, check=True).stdout
+            results[mode] = json.loads(out.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
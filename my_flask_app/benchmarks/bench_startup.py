@@ -0,0 +1,89 @@
+"""How long a worker (or a test) takes to boot: import, create_app, first request.
+
+    python benchmarks/bench_startup.py [--runs 10] [--logs 200000] [--bookings 2000]
+
+One temporary database is migrated and filled once (`--logs` raw door
+events, `--bookings` unused bookings, which the live state loads at boot).
+Then every run is a fresh process that imports app.py, calls create_app()
+and serves GET / and /api/dashboard_stats. 'check' is the normal path, which
+only reads PRAGMA user_version; 'migrate' is create_app(migrate_schema=True),
+as the dev server does it, which also walks the migrations and the admin check.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('check', 'migrate')
+
+
+def setup(logs, bookings):
+    sys.path.insert(0, APP_DIR)
+    import app as seatidle
+    seatidle.init_db()
+    now = int(time.time())
+    with seatidle.pool.connection() as conn:
+        conn.executemany('INSERT INTO logs (timestamp, ts, event_type, user_type, occupancy, zone_id) VALUES (?, ?, ?, ?, ?, 1)',
+                         [(seatidle.get_sl_time(now - i), now - i, 'ENTRY' if i % 2 else 'EXIT', 'STUDENT', i % 50) for i in range(logs)])
+        conn.executemany('INSERT INTO reservations (otp, name, res_date, time_slot, created_at, created_ts, is_used, user_id, zone_id) VALUES (?, ?, ?, ?, ?, ?, 0, 1, 1)',
+                         [(str(1000 + i), f'student{i}', '2099-01-01', '08:00 AM - 12:00 PM', seatidle.get_sl_time(now), now) for i in range(bookings)])
+
+
+def run_once(mode):
+    t = time.perf_counter()
+    sys.path.insert(0, APP_DIR)
+    import app as seatidle
+    imported = time.perf_counter()
+    seatidle.create_app(migrate_schema=mode == 'migrate')
+    created = time.perf_counter()
+    client = seatidle.app.test_client()
+    first = client.get('/').status_code, client.get('/api/dashboard_stats').status_code
+    served = time.perf_counter()
+    assert first == (200, 200), first
+    print(json.dumps({'import_ms': (imported - t) * 1000, 'create_app_ms': (created - imported) * 1000,
+                      'first_request_ms': (served - created) * 1000, 'total_ms': (served - t) * 1000}))
+
+
+def summary(samples):
+    return {'median': round(statistics.median(samples), 1), 'max': round(max(samples), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--logs', type=int, default=200000)
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--mode', choices=MODES + ('setup',), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == 'setup':
+        setup(args.logs, args.bookings)
+        return
+    if args.mode:
+        run_once(args.mode)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SEATIDLE_DB=os.path.join(tmp, 'bench.db'), SEATIDLE_RETENTION_INTERVAL_HOURS='0')
+        call = lambda *extra: subprocess.run([sys.executable, __file__, *extra], env=env, cwd=APP_DIR,
+                                             capture_output=True, text=True, check=True).stdout
+        call('--mode', 'setup', '--logs', str(args.logs), '--bookings', str(args.bookings))
+        for mode in MODES:
+            runs, wall = [], []
+            for _ in range(args.runs):
+                t = time.perf_counter()
+                runs.append(json.loads(call('--mode', mode).strip().splitlines()[-1]))
+                wall.append((time.perf_counter() - t) * 1000)
+            results[mode] = {key: summary([r[key] for r in runs]) for key in runs[0]}
+            results[mode]['process_wall_ms'] = summary(wall)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""Load test with a virtual ESP32 fleet and a room full of open dashboards.
+
+    python benchmarks/fleet.py [--devices 6] [--viewers 40] [--seconds 20]
+                               [--url http://127.0.0.1:5000] [--out results.json]
+                               [--compare old-results.json]
+
+N door units send doorway events in bursts (a class letting out), with the
+odd staff card scan and keypad code, plus their regular /ping and roster
+sync. M viewers poll like the pages do (live.js, with If-None-Match): most
+are dashboards, some the staff board, a few admins. Every request is timed
+per endpoint; the report has p50/p95/p99 latency, throughput, errors and
+SQLite lock waits.
+
+Without --url everything runs in this process against the Flask test client
+and a fresh temporary database, with lock waits counted by the app
+(SEATIDLE_DB_LOCK_STATS=1). With --url it drives a running server instead.
+That server must have the default admin account, and it gets some staff
+cards and bookings added. Lock waits then come from its /metrics (read as
+the admin, or with SEATIDLE_METRICS_TOKEN if set), so start it with
+SEATIDLE_DB_LOCK_STATS=1 to see any (with several gunicorn workers,
+only the worker that answers the scrape is counted). Seeding signs every
+student up from this one IP, so also raise SEATIDLE_LOGIN_IP_PER_MINUTE there.
+
+Results are written as JSON (default benchmarks/results/fleet-<commit>.json).
+--compare prints the change against an earlier run.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+from http.cookiejar import CookieJar
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(APP_DIR, 'benchmarks', 'results')
+SLOTS = ['08:00 AM - 12:00 PM', '12:00 PM - 04:00 PM', '04:00 PM - 08:00 PM']
+ADMIN = {'username': 'admin', 'password': 'admin123'}
+OTP_RE = re.compile(r'font-size: 48px[^>]*>(\d+)<')
+
+
+# --- TARGETS ---
+# A session is one virtual client (its own cookies). request() returns (status, body text, headers).
+
+class TestClientTarget:
+    def __init__(self, seatidle):
+        self.seatidle = seatidle
+
+    def session(self):
+        client = self.seatidle.app.test_client()
+        def request(method, path, payload=None, data=None, headers=None):
+            r = client.open(path, method=method, json=payload, data=data, headers=headers)
+            return r.status_code, r.get_data(as_text=True), r.headers
+        return request
+
+
+class HttpTarget:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def session(self):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        def request(method, path, payload=None, data=None, headers=None):
+            headers = dict(headers or {})
+            body = None
+            if payload is not None:
+                body = json.dumps(payload).encode()
+                headers['Content-Type'] = 'application/json'
+            elif data is not None:
+                body = urllib.parse.urlencode(data).encode()
+            req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+            try:
+                with opener.open(req, timeout=30) as r:
+                    return r.status, r.read().decode(), r.headers
+            except urllib.error.HTTPError as e:
+                return e.code, e.read().decode(), e.headers
+        return request
+
+
+# --- RECORDING ---
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # endpoint -> [seconds, ...]
+        self.statuses = {}  # endpoint -> {status: count}
+
+    def timed(self, endpoint, request, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body, headers = request(*args, **kwargs)
+        except Exception:
+            status, body, headers = 'exception', '', {}
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append(elapsed)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+        return status, body, headers
+
+    def report(self, seconds):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            samples = sorted(samples)
+            pick = lambda q: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+            statuses = self.statuses[endpoint]
+            # 304 and the 400s a wrong keypad code gets are expected answers, not errors
+            errors = sum(n for s, n in statuses.items() if s == 'exception' or int(s) >= 500)
+            endpoints[endpoint] = {'requests': len(samples), 'rps': round(len(samples) / seconds, 1), 'errors': errors,
+                                   'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'max_ms': pick(1.0),
+                                   'statuses': statuses}
+        return endpoints
+
+
+# --- SEEDING ---
+
+def seed(target, staff_cards, bookings):
+    # Staff cards through the admin panel, bookings through student accounts; returns the booking codes
+    admin = target.session()
+    admin('POST', '/login', data=ADMIN)
+    for i in range(staff_cards):
+        admin('POST', '/admin/panel', data={'add_staff': 'true', 'new_uid': f'FLEET-{i:03d}', 'new_name': f'Fleet Staff {i}'})
+    codes = []
+    day = (date.today() + timedelta(days=2)).isoformat()  # safely in the future in any timezone
+    run_id = random.randrange(1 << 30)
+    for i in range(bookings):
+        student = target.session()
+        name = f'fleet-{run_id}-{i}'
+        student('POST', '/register', data={'username': name, 'password': 'fleet', 'confirm_password': 'fleet'})
+        student('POST', '/login', data={'username': name, 'password': 'fleet'})
+        status, body, _ = student('POST', '/reservations', data={'create_booking': 'true', 'date': day, 'time': SLOTS[i % len(SLOTS)]})
+        match = OTP_RE.search(body)
+        if match: codes.append(match.group(1))
+    return [f'FLEET-{i:03d}' for i in range(staff_cards)], codes
+
+
+# --- VIRTUAL CLIENTS ---
+
+def device(n, target, rec, deadline, cards, codes, codes_lock, args):
+    rng = random.Random(args.seed * 1000 + n)
+    request = target.session()
+    device_id = f'fleet-door-{n}'
+    headers = {'X-Device-Id': device_id}
+    occupancy = 0
+    roster = 0
+    next_ping = next_sync = time.perf_counter()
+    while time.perf_counter() < deadline:
+        now = time.perf_counter()
+        if now >= next_ping:
+            rec.timed('/ping', request, 'GET', '/ping', headers=headers)
+            next_ping = now + args.ping_every
+        if now >= next_sync:
+            status, body, _ = rec.timed('/get_staff', request, 'GET', f'/get_staff?since={roster}', headers=headers)
+            if status == 200 and '|' in body: roster = int(body.split('|', 1)[0])
+            next_sync = now + args.sync_every
+
+        # A burst: people streaming through the door, a few seconds apart at most
+        for _ in range(rng.randint(3, 25)):
+            if time.perf_counter() >= deadline: return
+            roll = rng.random()
+            if roll < 0.05 and cards:
+                rec.timed('/update_data (staff)', request, 'POST', '/update_data', headers=headers,
+                          payload={'occupancy': occupancy, 'event': rng.choice(['ENTRY', 'EXIT']), 'user': 'STAFF', 'uid': rng.choice(cards)})
+            elif roll < 0.10:
+                with codes_lock:
+                    code = codes.pop() if codes and rng.random() < 0.7 else f'{rng.randint(1000, 9999)}'
+                rec.timed('/verify_otp', request, 'POST', '/verify_otp', headers=headers, payload={'otp': code})
+            else:
+                entering = occupancy == 0 or rng.random() < 0.55
+                occupancy += 1 if entering else -1
+                rec.timed('/update_data', request, 'POST', '/update_data', headers=headers,
+                          payload={'occupancy': occupancy, 'event': 'ENTRY' if entering else 'EXIT', 'user': 'STUDENT'})
+            time.sleep(rng.uniform(0.02, 0.15) * args.pace)
+        time.sleep(rng.uniform(0.5, 3.0) * args.pace)
+
+
+VIEWS = {
+    'dashboard': ['/api/dashboard_stats'],
+    'staff': ['/api/get_active_staff_cards'],
+    'admin': ['/api/admin_stats', '/api/get_reservations_table', '/api/get_staff_table'],
+}
+
+
+def viewer(n, target, rec, deadline, args):
+    rng = random.Random(args.seed * 1000 + 500 + n)
+    request = target.session()
+    roll = rng.random()
+    kind = 'admin' if roll < 0.1 else 'staff' if roll < 0.3 else 'dashboard'
+    if kind == 'admin': request('POST', '/login', data=ADMIN)
+    etags = {}
+    time.sleep(rng.uniform(0, args.poll))  # pages weren't all opened at the same instant
+    while time.perf_counter() < deadline:
+        for path in VIEWS[kind]:
+            headers = {'If-None-Match': etags[path]} if path in etags else {}
+            status, _, response_headers = rec.timed(path, request, 'GET', path, headers=headers)
+            if status == 200 and response_headers.get('ETag'): etags[path] = response_headers['ETag']
+        time.sleep(args.poll)
+
+
+# --- RUNNING ---
+
+def scrape_lock_waits(target):
+    # route -> {'waits', 'seconds'} from the server's /metrics (None if it won't tell us). Scrapes with
+    # SEATIDLE_METRICS_TOKEN if it is set here, otherwise as the admin.
+    request = target.session()
+    token = os.environ.get('SEATIDLE_METRICS_TOKEN')
+    if not token: request('POST', '/login', data=ADMIN)
+    status, body, _ = request('GET', '/metrics', headers={'Authorization': f'Bearer {token}'} if token else None)
+    if status != 200: return None
+    waits = {}
+    for line in body.splitlines():
+        for metric, key in (('seatidle_db_lock_waits_total{', 'waits'), ('seatidle_db_lock_wait_seconds_total{', 'seconds')):
+            if line.startswith(metric):
+                route = line[line.index('route="') + 7:line.rindex('"}')]
+                waits.setdefault(route, {'waits': 0, 'seconds': 0.0})[key] = float(line.rsplit(' ', 1)[1])
+    return waits
+
+
+def lock_wait_delta(before, after):
+    if before is None or after is None: return None
+    delta = {}
+    for route, now in after.items():
+        old = before.get(route, {'waits': 0, 'seconds': 0.0})
+        if now['waits'] > old['waits']:
+            delta[route] = {'waits': int(now['waits'] - old['waits']), 'seconds': round(now['seconds'] - old['seconds'], 4)}
+    return delta
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(current, baseline):
+    print(f"\n{'endpoint':<28}{'p95 ms':>18}{'p99 ms':>18}{'rps':>18}")
+    for endpoint, now in current['endpoints'].items():
+        old = baseline['endpoints'].get(endpoint)
+        if not old: continue
+        cell = lambda key: f"{old[key]}→{now[key]}"
+        print(f"{endpoint:<28}{cell('p95_ms'):>18}{cell('p99_ms'):>18}{cell('rps'):>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=6)
+    parser.add_argument('--viewers', type=int, default=40)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--url', help='drive a running server instead of the in-process test client')
+    parser.add_argument('--staff', type=int, default=20, help='staff cards to add before the run')
+    parser.add_argument('--bookings', type=int, default=60, help='bookings to make before the run (their codes get typed in)')
+    parser.add_argument('--poll', type=float, default=2.0, help='seconds between polls per viewer (the pages use 2)')
+    parser.add_argument('--pace', type=float, default=1.0, help='scales the gaps between door events (<1 = busier)')
+    parser.add_argument('--ping-every', type=float, default=30.0)
+    parser.add_argument('--sync-every', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='JSON results file (default benchmarks/results/fleet-<commit>.json)')
+    parser.add_argument('--compare', help='earlier JSON results to compare with')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    seatidle = tmp = None
+    if args.url:
+        target = HttpTarget(args.url)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        os.environ.update(SEATIDLE_DB=os.path.join(tmp.name, 'fleet.db'), SEATIDLE_DB_LOCK_STATS='1',
+                          SEATIDLE_RETENTION_INTERVAL_HOURS='0', SEATIDLE_LOGIN_IP_PER_MINUTE='100000')  # seeding signs up every student from one IP
+        sys.path.insert(0, APP_DIR)
+        import app as seatidle
+        seatidle.create_app(migrate_schema=True)
+        target = TestClientTarget(seatidle)
+
+    cards, codes = seed(target, args.staff, args.bookings)
+    if seatidle: seatidle.db_lock_stats.reset()  # only count the run itself
+    waits_before = scrape_lock_waits(target) if args.url else None
+    rec = Recorder()
+    codes_lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=device, args=(n, target, rec, deadline, cards, codes, codes_lock, args)) for n in range(args.devices)]
+    threads += [threading.Thread(target=viewer, args=(n, target, rec, deadline, args)) for n in range(args.viewers)]
+    started = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+    if seatidle: seatidle.ingest.flush()
+
+    results = {
+        'commit': git_commit(),
+        'when': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'target': args.url or 'test-client',
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'url')},
+        'seconds': round(elapsed, 2),
+        'endpoints': rec.report(elapsed),
+        'lock_waits': seatidle.db_lock_stats.snapshot() if seatidle else lock_wait_delta(waits_before, scrape_lock_waits(target)),
+    }
+
+    print(f"{'endpoint':<28}{'requests':>10}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for endpoint, r in results['endpoints'].items():
+        print(f"{endpoint:<28}{r['requests']:>10}{r['rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['errors']:>8}")
+    if results['lock_waits'] is not None:
+        print("\nSQLite lock waits:", json.dumps(results['lock_waits']) if results['lock_waits'] else "none")
+
+    out = args.out or os.path.join(RESULTS_DIR, f"fleet-{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved {out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if tmp: tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
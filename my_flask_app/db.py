@@ -0,0 +1,142 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# --- CONNECTION POOL ---
+# Reuses SQLite connections instead of opening a new one for every helper.
+# WAL lets the dashboard keep reading while the ESP32 writes, and the
+# busy timeout makes writers queue up instead of failing with
+# "database is locked".
+
+PRAGMAS = (
+    'PRAGMA auto_vacuum = INCREMENTAL',  # only sticks on a brand-new file; lets log retention free space
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',   # WAL is crash-safe at NORMAL; only fsyncs on checkpoint
+    'PRAGMA cache_size = -8000',     # ~8 MB page cache per connection
+    'PRAGMA mmap_size = 67108864',   # 64 MB of memory-mapped reads
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+STATEMENT_CACHE = 256  # prepared statements kept per connection
+LOCK_TIMEOUT = 5.0  # same as busy_timeout, for connections that count their lock waits
+
+
+# --- INSTRUMENTED CONNECTIONS ---
+# With busy_timeout SQLite waits for the write lock silently. For load tests,
+# connections can instead be opened with busy_timeout = 0 and do the waiting
+# in Python, so every wait is counted (per request path or thread name).
+# Independently, an observer can be told how long each statement took
+# (metrics.py); that is time to the first row, fetching isn't included.
+
+class LockStats:
+    def __init__(self, label=None):
+        self.label = label  # callable naming who is waiting; defaults to the thread name
+        self._lock = threading.Lock()
+        self._waits = {}  # label -> [waits, seconds]
+
+    def record(self, seconds):
+        label = self.label() if self.label else threading.current_thread().name
+        with self._lock:
+            entry = self._waits.setdefault(label, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def reset(self):
+        with self._lock:
+            self._waits = {}
+
+    def snapshot(self):
+        with self._lock:
+            return {label: {'waits': n, 'seconds': round(s, 4)} for label, (n, s) in sorted(self._waits.items())}
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    lock_stats = None  # LockStats: retry "database is locked" here and count the waits
+    observer = None  # callable(sql, seconds, lock_wait_seconds) after every statement
+
+    def _run(self, run, sql, *args):
+        start = time.perf_counter()
+        # Only a statement that opens the transaction can be retried; later ones would lose earlier work
+        opened = not self.in_transaction
+        waited, delay = 0.0, 0.001
+        while True:
+            try:
+                result = run(sql, *args)
+            except sqlite3.OperationalError as e:
+                if self.lock_stats is None or 'locked' not in str(e) or not opened or waited >= LOCK_TIMEOUT: raise
+                if self.in_transaction: self.rollback()
+                time.sleep(delay)
+                waited += delay
+                delay = min(delay * 2, 0.05)
+                continue
+            if waited: self.lock_stats.record(waited)
+            if self.observer: self.observer(sql, time.perf_counter() - start, waited)
+            return result
+
+    def execute(self, sql, *args):
+        return self._run(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._run(super().executemany, sql, *args)
+
+
+class ConnectionPool:
+    def __init__(self, path, size=8, tuned=True, lock_stats=None, observer=None):
+        # size is how many idle connections to keep; tuned=False gives the old
+        # one-connect-per-use behaviour (used by the benchmark as a baseline)
+        self.path = path
+        self.size = size
+        self.tuned = tuned
+        self.lock_stats = lock_stats  # a LockStats to count lock waits in (load tests)
+        self.observer = observer  # per-statement timing callback, see InstrumentedConnection
+        self._idle = queue.LifoQueue()
+
+    def _open(self):
+        factory = InstrumentedConnection if self.lock_stats or self.observer else sqlite3.Connection
+        if self.tuned:
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE, factory=factory)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, factory=factory)
+        if self.observer: conn.observer = self.observer
+        if self.lock_stats:
+            conn.lock_stats = self.lock_stats
+            conn.execute('PRAGMA busy_timeout = 0')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+
+    def release(self, conn):
+        if conn.in_transaction: conn.rollback()
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        # For code outside a request (startup, background threads); commits on success
+        conn = self.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
+
+    def idle_count(self):
+        return self._idle.qsize()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,78 @@
+import json
+import threading
+
+# --- LIVE EVENT BROKER ---
+# Fans change notifications out to every open /api/stream connection.
+# Each subscriber only ever holds the latest payload per topic: if a browser
+# falls behind, newer events overwrite the ones it hasn't read yet instead of
+# piling up, so a slow client costs a few dict slots, never an unbounded queue.
+# A payload may carry only part of the picture (e.g. just the zone a door event
+# touched); what it leaves out is kept from the one it replaces.
+
+
+class Subscription:
+    def __init__(self, topics):
+        self.topics = set(topics)
+        self.pending = {}  # topic -> latest payload not yet sent
+        self.dropped = 0  # events superseded before the client read them
+        self._cond = threading.Condition()
+
+    def push(self, topic, data):
+        with self._cond:
+            if topic in self.pending:
+                self.dropped += 1
+                data = _merge(self.pending[topic], data)
+            self.pending[topic] = data
+            self._cond.notify()
+
+    def wait(self, timeout):
+        # Returns [(topic, payload), ...], or [] if nothing happened before the timeout
+        with self._cond:
+            if not self.pending: self._cond.wait(timeout)
+            events = list(self.pending.items())
+            self.pending.clear()
+            return events
+
+
+def _merge(old, new):
+    if not (isinstance(old, dict) and isinstance(new, dict)): return new
+    merged = dict(old, **new)
+    if 'zones' in old and 'zones' in new:
+        ids = {z['id'] for z in new['zones']}
+        merged['zones'] = [z for z in old['zones'] if z['id'] not in ids] + new['zones']
+    return merged
+
+
+class EventBroker:
+    def __init__(self, max_subscribers=100):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self, topics):
+        # Returns None once this worker is at its subscriber cap
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers: return None
+            sub = Subscription(topics)
+            self._subscribers.add(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, topic, data=None):
+        # data may be a callable, called only if someone is subscribed to `topic`
+        with self._lock:
+            subscribers = [s for s in self._subscribers if topic in s.topics]
+        if not subscribers: return
+        if callable(data): data = data()
+        for sub in subscribers:
+            sub.push(topic, data)
+
+
+def format_sse(topic, data):
+    return f"event: {topic}\ndata: {json.dumps(data)}\n\n"
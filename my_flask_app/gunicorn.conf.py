@@ -0,0 +1,36 @@
+import multiprocessing
+import os
+
+# --- GUNICORN CONFIG ---
+# gunicorn -c gunicorn.conf.py
+# Several worker processes, each with a pool of threads (an open live page
+# holds one thread for its event stream). Workers share state through
+# library.db (SEATIDLE_STATE_BACKEND=sqlite, see shared.py).
+
+os.environ.setdefault('SEATIDLE_STATE_BACKEND', 'sqlite')
+# Heartbeats are the only thing workers learn about by timer, so save them well inside the 65 s online window
+os.environ.setdefault('SEATIDLE_HEARTBEAT_PERSIST', '20')
+
+wsgi_app = 'wsgi:application'
+bind = os.environ.get('SEATIDLE_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('SEATIDLE_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('SEATIDLE_THREADS', '32'))
+# An open live page holds a thread for as long as its stream is open, and a login waiting on
+# password hashing holds one too. Both are capped so that `request_reserve` threads always stay
+# free for the door units (/update_data, /verify_otp, /ping) and page loads; pages turned
+# away from the stream fall back to polling.
+request_reserve = max(2, threads // 4)
+auth_pending = max(1, min(int(os.environ.get('SEATIDLE_AUTH_MAX_PENDING', '8')), (threads - request_reserve) // 2))
+sse_subscribers = max(0, min(int(os.environ.get('SEATIDLE_SSE_MAX_SUBSCRIBERS', '100')), threads - request_reserve - auth_pending))
+os.environ['SEATIDLE_AUTH_MAX_PENDING'] = str(auth_pending)
+os.environ['SEATIDLE_SSE_MAX_SUBSCRIBERS'] = str(sse_subscribers)
+preload_app = False  # each worker starts its own background threads after the fork
+graceful_timeout = 10  # lets each worker's ingest queue flush on shutdown
+
+
+def on_starting(server):
+    # Runs once in the master, before any worker exists
+    from app import init_db, pool
+    init_db()
+    pool.close_all()  # don't hand SQLite connections across fork()
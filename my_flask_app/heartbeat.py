@@ -0,0 +1,122 @@
+import threading
+import time
+
+from zones import DEFAULT_ZONE
+
+# --- DEVICE HEARTBEATS ---
+# Tracks when each door unit (ESP32) last talked to us, on the monotonic
+# clock, entirely in memory. The database only hears about it when a device
+# goes online/offline, or every `persist_interval` seconds while it stays
+# online, so a restart doesn't forget who was around. Each device belongs to
+# the zone (reading room) it last said it was in.
+
+DEFAULT_DEVICE = 'door-1'
+
+
+class HeartbeatRegistry:
+    def __init__(self, online_window=65, persist_interval=60, max_devices=64):
+        self.online_window = online_window
+        self.persist_interval = persist_interval
+        self.max_devices = max_devices  # device ids come from the client, so don't let them grow forever
+        self.persist = None  # callback(device_id, last_seen_epoch, online, zone_id)
+        self.forget = None  # callback(device_id) after an entry was evicted to make room
+        self.on_change = None  # callback() after any device goes online/offline or moves zone
+        self._lock = threading.Lock()
+        self._devices = {}  # id -> {'last': monotonic, 'online': bool, 'persisted': monotonic, 'zone': zone id}
+
+    def load(self, rows):
+        # rows: (device_id, last_seen_epoch, zone_id) as stored by `persist`
+        now_mono, now_wall = time.monotonic(), time.time()
+        rows = sorted((r for r in rows if r[1] is not None), key=lambda r: r[1], reverse=True)[:self.max_devices]
+        with self._lock:
+            for device_id, last_seen, zone_id in rows:
+                last = now_mono - (now_wall - last_seen)
+                self._devices[device_id] = {'last': last, 'online': now_mono - last <= self.online_window, 'persisted': now_mono,
+                                            'zone': zone_id or DEFAULT_ZONE}
+
+    def merge(self, rows):
+        # Like load, but for heartbeats other worker processes saved: only newer ones count
+        now_mono, now_wall = time.monotonic(), time.time()
+        changed = False
+        evicted = []
+        with self._lock:
+            for device_id, last_seen, zone_id in rows:
+                if last_seen is None: continue
+                last = now_mono - (now_wall - last_seen)
+                dev = self._devices.get(device_id)
+                if dev is None:
+                    if len(self._devices) >= self.max_devices:
+                        if last <= self._stalest()[1]['last']: continue  # older than anything we keep
+                        evicted.append(self._evict())
+                    dev = self._devices[device_id] = {'last': float('-inf'), 'online': False, 'persisted': now_mono, 'zone': zone_id}
+                if last <= dev['last']: continue
+                dev['last'] = last
+                if dev['zone'] != zone_id: dev['zone'], changed = zone_id, True
+                if not dev['online'] and now_mono - last <= self.online_window:
+                    dev['online'] = changed = True
+        self._forget(evicted)
+        if (changed or evicted) and self.on_change: self.on_change()
+
+    def beat(self, device_id=DEFAULT_DEVICE, zone_id=DEFAULT_ZONE):
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            dev = self._devices.get(device_id)
+            if dev is None:
+                if len(self._devices) >= self.max_devices: evicted.append(self._evict())
+                dev = self._devices[device_id] = {'last': now, 'online': False, 'persisted': float('-inf'), 'zone': zone_id}
+            dev['last'] = now
+            changed = not dev['online'] or dev['zone'] != zone_id
+            dev['online'] = True
+            dev['zone'] = zone_id
+            due = changed or now - dev['persisted'] >= self.persist_interval
+            if due: dev['persisted'] = now
+        self._forget(evicted)
+        if due: self._persist(device_id, now, True, zone_id)
+        if changed and self.on_change: self.on_change()
+
+    def _stalest(self):
+        # Offline devices go first, then whoever was heard from longest ago; call with the lock held
+        return min(self._devices.items(), key=lambda item: (item[1]['online'], item[1]['last']))
+
+    def _evict(self):
+        device_id = self._stalest()[0]
+        del self._devices[device_id]
+        return device_id
+
+    def _forget(self, device_ids):
+        if self.forget:
+            for device_id in device_ids: self.forget(device_id)
+
+    def sweep(self):
+        # Flip devices that have gone quiet to offline; cheap enough to call on every read
+        now = time.monotonic()
+        went_offline = []
+        with self._lock:
+            for device_id, dev in self._devices.items():
+                if dev['online'] and now - dev['last'] > self.online_window:
+                    dev['online'] = False
+                    dev['persisted'] = now
+                    went_offline.append((device_id, dev['last'], dev['zone']))
+        for device_id, last, zone_id in went_offline:
+            self._persist(device_id, last, False, zone_id)
+        if went_offline and self.on_change: self.on_change()
+
+    def _persist(self, device_id, last_mono, online, zone_id):
+        if self.persist:
+            self.persist(device_id, time.time() - (time.monotonic() - last_mono), online, zone_id)
+
+    def any_online(self, zone_id=None):
+        # Across the campus, or in one zone
+        self.sweep()
+        with self._lock:
+            return any(dev['online'] for dev in self._devices.values() if zone_id is None or dev['zone'] == zone_id)
+
+    def summary(self):
+        self.sweep()
+        now = time.monotonic()
+        with self._lock:
+            wall = time.time()
+            return [{'id': device_id, 'zone': dev['zone'], 'online': 1 if dev['online'] else 0, 'last_seen_ago': round(now - dev['last'], 1),
+                     'last_seen': int(wall - (now - dev['last']))}
+                    for device_id, dev in sorted(self._devices.items())]
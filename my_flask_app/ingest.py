@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+import time
+
+import rollups
+from state import save_roster_changes
+
+# --- SENSOR INGEST QUEUE ---
+# /update_data hands each doorway event to this queue and answers the ESP32
+# straight away. A single writer thread collects whatever arrives within a
+# short window and writes it in one transaction (one fsync per batch instead
+# of per event). Only the newest available_seats value per zone in a batch is
+# written; every event still gets its own row in `logs` and is folded into the
+# occupancy rollups in the same transaction.
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class IngestQueue:
+    def __init__(self, pool, window=0.05, batch_max=200, on_exit='flush', notify=None):
+        self.pool = pool
+        self.notify = notify  # notify(conn, *topics) inside the batch transaction (shared state)
+        self.on_commit = None  # callback(topics) after a batch is committed
+        self.window = window  # seconds to keep collecting after the first event of a batch
+        self.batch_max = batch_max
+        self.on_exit = on_exit  # 'flush' = write everything queued on shutdown, 'drop' = don't wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._unwritten = 0  # submitted events whose batch hasn't been written (or dropped) yet
+        self._unwritten_lock = threading.Lock()
+
+    def submit(self, event):
+        # event: dict with timestamp, ts (epoch), event_type, user_type, occupancy, zone and optional
+        # 'seats' (the zone's new available_seats) and 'staff' ((uid, is_present)) entries
+        if self._thread is None: self._start()
+        with self._unwritten_lock: self._unwritten += 1
+        self._queue.put(event)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                self._queue.task_done()
+                return
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_max:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            topics = self._write_with_retry(batch)
+            with self._unwritten_lock: self._unwritten -= len(batch)
+            if topics is not None: self.committed(topics)
+            for _ in batch: self._queue.task_done()
+            if stop:
+                self._queue.task_done()
+                return
+
+    def _write_with_retry(self, batch, attempts=3):
+        # Returns the batch's topics, or None if it was dropped
+        for attempt in range(attempts):
+            try:
+                return self.write(batch)
+            except Exception:
+                if attempt == attempts - 1:
+                    log.exception("Dropping %d sensor events after %d failed writes", len(batch), attempts)
+                else:
+                    time.sleep(0.1 * (attempt + 1))
+
+    def write(self, batch):
+        # Also used directly (synchronous mode) with a one-event batch; returns the changed topics.
+        # Doesn't call on_commit, so a failing callback can't make a retry write the batch twice.
+        seats = {}  # zone -> newest available_seats
+        staff = {}
+        roster = []
+        logs = []
+        for event in batch:
+            if event.get('seats') is not None: seats[event['zone']] = event['seats']
+            if event.get('staff'):
+                uid, is_present = event['staff']
+                staff[uid] = (is_present, event['timestamp'], uid)
+                roster.append((uid, is_present))
+            logs.append((event['timestamp'], int(event['ts']), event['event_type'], event['user_type'], event['occupancy'], event['zone']))
+
+        with self.pool.connection() as conn:
+            if staff:
+                conn.executemany('UPDATE staff SET is_present = ?, last_seen = ? WHERE uid = ?', list(staff.values()))
+                save_roster_changes(conn, roster)
+            if seats:
+                conn.executemany('UPDATE zones SET available_seats = ? WHERE id = ?', [(v, z) for z, v in seats.items()])
+            conn.executemany("INSERT INTO logs (timestamp, ts, event_type, user_type, occupancy, zone_id) VALUES (?, ?, ?, ?, ?, ?)", logs)
+            rollups.apply(conn, [(e['ts'], e['event_type'], e['user_type'], e['occupancy'], e['zone']) for e in batch])
+            topics = (('staff',) if staff else ()) + (('seats',) if seats else ())
+            if topics and self.notify: self.notify(conn, *topics)
+        return topics
+
+    def committed(self, topics):
+        # Runs on_commit for a batch write() has committed
+        if not self.on_commit: return
+        try:
+            self.on_commit(topics)
+        except Exception:
+            log.exception("on_commit failed after a committed batch")
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def busy(self):
+        # Events submitted but not yet committed, including the batch being written (not one
+        # whose on_commit is running)
+        return self._unwritten > 0
+
+    def flush(self):
+        # Blocks until everything submitted so far is in the database
+        if self._thread is not None: self._queue.join()
+
+    def shutdown(self):
+        if self._thread is None or self.on_exit == 'drop': return
+        self._queue.put(_STOP)
+        self._thread.join()
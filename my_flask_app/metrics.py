@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+
+from flask import before_render_template, g, got_request_exception, has_request_context, request, template_rendered
+
+# --- METRICS ---
+# Where the time goes, per route: how long each request took, how many SQL
+# statements it ran and how long they took (including waits for the write
+# lock when those are being counted), how long each template took to render.
+# Everything is kept as Prometheus-style cumulative histograms and counters
+# and served as text at /metrics; Prometheus (or anything that diffs two
+# scrapes) turns them into rolling rates and percentiles. Optionally,
+# requests slower than a threshold are logged together with their queries.
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_LOGGED_QUERIES = 50  # per slow request
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    return ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> total
+
+    def inc(self, values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{_labels(self.labels, values)}}} {total:g}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        self.name, self.help, self.label, self.buckets = name, help, label, buckets
+        self._lock = threading.Lock()
+        self._series = {}  # label value -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, seconds):
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for value, series in sorted(self._series.items()):
+                label = _labels((self.label,), (value,))
+                running = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    running += count
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {running}')
+                lines.append(f'{self.name}_sum{{{label}}} {series[-1]:.6f}')
+                lines.append(f'{self.name}_count{{{label}}} {running}')
+        return lines
+
+
+def current_route():
+    # The URL rule, not the path, so /admin/edit_staff/<uid> is one series; background threads go by name
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return threading.current_thread().name
+
+
+class Metrics:
+    def __init__(self, slow_ms=0):
+        self.slow_ms = slow_ms  # log requests slower than this (0 = don't)
+        self.requests = Counter('seatidle_requests_total', 'Requests answered, per route, method and status.', ('route', 'method', 'status'))
+        self.request_seconds = Histogram('seatidle_request_duration_seconds', 'Time from request start to response, per route.', 'route')
+        self.exceptions = Counter('seatidle_exceptions_total', 'Unhandled exceptions, per route.', ('route',))
+        self.queries = Counter('seatidle_db_queries_total', 'SQL statements run, per route or background thread.', ('route',))
+        self.query_seconds = Histogram('seatidle_db_query_duration_seconds', 'SQL statement time to first row, per route or background thread.', 'route')
+        self.lock_waits = Counter('seatidle_db_lock_waits_total', 'Statements that had to wait for the SQLite write lock (only counted with SEATIDLE_DB_LOCK_STATS=1).', ('route',))
+        self.lock_wait_seconds = Counter('seatidle_db_lock_wait_seconds_total', 'Time spent waiting for the SQLite write lock.', ('route',))
+        self.render_seconds = Histogram('seatidle_template_render_seconds', 'Template render time, per template.', 'template')
+        self._gauges = []  # (name, help, read)
+
+    def gauge(self, name, help, read):
+        self._gauges.append((name, help, read))
+
+    def init_app(self, app):
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._finish_render, app)
+        got_request_exception.connect(self._exception, app)
+
+    # --- HOOKS ---
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = [] if self.slow_ms else None  # only kept for the slow-request log
+
+    def _finish_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None: return response
+        elapsed = time.perf_counter() - start
+        route = current_route()
+        self.request_seconds.observe(route, elapsed)
+        self.requests.inc((route, request.method, response.status_code))
+        if self.slow_ms and elapsed * 1000 >= self.slow_ms: self._log_slow(elapsed)
+        return response
+
+    def _log_slow(self, elapsed):
+        queries = g.get('metrics_queries', [])
+        lines = [f"  {seconds * 1000:7.2f} ms  {' '.join(sql.split())}" for sql, seconds in queries[:MAX_LOGGED_QUERIES]]
+        if len(queries) > MAX_LOGGED_QUERIES: lines.append(f"  ... {len(queries) - MAX_LOGGED_QUERIES} more")
+        db_ms = sum(seconds for _, seconds in queries) * 1000
+        log.warning("Slow request %s %s: %.0f ms, %d queries (%.0f ms in SQL)\n%s",
+                    request.method, request.full_path.rstrip('?'), elapsed * 1000, len(queries), db_ms, '\n'.join(lines))
+
+    def _start_render(self, sender, template, context, **extra):
+        g.setdefault('metrics_renders', []).append(time.perf_counter())
+
+    def _finish_render(self, sender, template, context, **extra):
+        starts = g.get('metrics_renders')
+        if starts: self.render_seconds.observe(template.name, time.perf_counter() - starts.pop())
+
+    def _exception(self, sender, exception, **extra):
+        self.exceptions.inc((current_route(),))
+
+    def observe_query(self, sql, seconds, lock_wait):
+        # Called by every pooled connection (db.InstrumentedConnection)
+        route = current_route()
+        self.queries.inc((route,))
+        self.query_seconds.observe(route, seconds)
+        if lock_wait:
+            self.lock_waits.inc((route,))
+            self.lock_wait_seconds.inc((route,), lock_wait)
+        if has_request_context():
+            queries = g.get('metrics_queries')
+            if queries is not None: queries.append((sql, seconds))
+
+    # --- EXPOSITION ---
+    def render(self):
+        lines = []
+        for metric in (self.requests, self.request_seconds, self.exceptions, self.queries, self.query_seconds,
+                       self.lock_waits, self.lock_wait_seconds, self.render_seconds):
+            lines += metric.render()
+        for name, help, read in self._gauges:
+            try:
+                value = read()
+            except Exception:
+                log.exception("Reading gauge %s failed", name)
+                continue
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge', f'{name} {value:g}']
+        return '\n'.join(lines) + '\n'
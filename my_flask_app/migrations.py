@@ -0,0 +1,183 @@
+import re
+
+import rollups
+
+# --- SCHEMA MIGRATIONS ---
+# Every schema change is a numbered step. PRAGMA user_version stores the last
+# step applied, so each one runs exactly once per database file, inside its
+# own transaction. A step must keep building what it always built, so
+# steps that have since been superseded keep their own copy of the old SQL.
+
+_ROLLUPS_V3 = '''CREATE TABLE IF NOT EXISTS occupancy_rollups (
+    granularity TEXT, bucket INTEGER, min_occ INTEGER, max_occ INTEGER, sum_occ INTEGER, samples INTEGER,
+    entries INTEGER, exits INTEGER, staff_events INTEGER, student_events INTEGER,
+    PRIMARY KEY (granularity, bucket)) WITHOUT ROWID'''
+
+
+def _backfill_rollups_v3(conn):
+    # The original, zone-less rollups.backfill
+    for granularity, width in rollups.GRANULARITIES.items():
+        conn.execute('''INSERT INTO occupancy_rollups (granularity, bucket, min_occ, max_occ, sum_occ, samples, entries, exits, staff_events, student_events)
+            SELECT ?, (l - l % ?) - ?, min(occupancy), max(occupancy), sum(occupancy), count(*),
+                   sum(event_type = 'ENTRY'), sum(event_type = 'EXIT'), sum(user_type = 'STAFF'), sum(user_type != 'STAFF')
+            FROM (SELECT CAST(strftime('%s', timestamp) AS INTEGER) AS l, event_type, user_type, max(0, occupancy) AS occupancy
+                  FROM logs WHERE timestamp IS NOT NULL)
+            WHERE l IS NOT NULL
+            GROUP BY 2''', (granularity, width, rollups.UTC_OFFSET))
+
+
+def _seed_main_zone(conn):
+    # Zone 1 takes over the old single capacity setting and status row
+    row = conn.execute("SELECT value FROM settings WHERE key = 'total_capacity'").fetchone()
+    total = int(row[0]) if row else 50
+    row = conn.execute('SELECT available_seats FROM status WHERE id = 1').fetchone()
+    conn.execute('INSERT OR IGNORE INTO zones (id, name, total_capacity, available_seats) VALUES (1, ?, ?, ?)',
+                 ('Main Library', total, row[0] if row else total))
+
+
+def _fill_epoch_columns(conn):
+    # The text columns hold Sri Lanka local time; the offset is fixed (no DST)
+    conn.execute("UPDATE logs SET ts = CAST(strftime('%s', timestamp) AS INTEGER) - ?", (rollups.UTC_OFFSET,))
+    conn.execute("UPDATE reservations SET created_ts = CAST(strftime('%s', created_at) AS INTEGER) - ?", (rollups.UTC_OFFSET,))
+
+
+MIGRATIONS = [
+    (1, "baseline schema", [
+        '''CREATE TABLE IF NOT EXISTS status (id INTEGER PRIMARY KEY, available_seats INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS staff (uid TEXT PRIMARY KEY, name TEXT, is_present INTEGER, last_seen TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS announcements (id INTEGER PRIMARY KEY, message TEXT, created_at TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, event_type TEXT, user_type TEXT, occupancy INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS reservations (otp TEXT PRIMARY KEY, name TEXT, res_date TEXT, time_slot TEXT, created_at TEXT, is_used INTEGER, user_id INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password TEXT, role TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS devices (id TEXT PRIMARY KEY, last_seen TEXT, last_seen_ts REAL, online INTEGER)''',
+    ]),
+    (2, "indexes for dashboard, booking and log queries", [
+        # Partial indexes only hold unused bookings / present staff, so they stay small as history grows
+        '''CREATE INDEX IF NOT EXISTS idx_reservations_user_active ON reservations(user_id, created_at) WHERE is_used = 0''',
+        '''CREATE INDEX IF NOT EXISTS idx_reservations_created ON reservations(created_at)''',
+        '''CREATE INDEX IF NOT EXISTS idx_staff_present ON staff(uid) WHERE is_present = 1''',
+        '''CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)''',
+        "CREATE INDEX IF NOT EXISTS idx_users_admin ON users(id) WHERE role = 'admin'",
+    ]),
+    (3, "occupancy rollups", [
+        _ROLLUPS_V3,
+        _backfill_rollups_v3,
+    ]),
+    (4, "staff roster change journal", [
+        # One row per roster change, seq = roster version; lets door units sync deltas after a restart
+        '''CREATE TABLE IF NOT EXISTS staff_changes (seq INTEGER PRIMARY KEY, uid TEXT, is_present INTEGER)''',
+        # Cards that already exist are the first changes, so the roster version starts above 0
+        '''INSERT INTO staff_changes (uid, is_present) SELECT uid, is_present FROM staff ORDER BY uid''',
+    ]),
+    (5, "reservations keyed by id; OTPs only unique among unused bookings", [
+        # With the OTP as primary key a used code could never be handed out again
+        '''CREATE TABLE reservations_new (id INTEGER PRIMARY KEY, otp TEXT, name TEXT, res_date TEXT, time_slot TEXT, created_at TEXT, is_used INTEGER, user_id INTEGER)''',
+        '''INSERT INTO reservations_new (otp, name, res_date, time_slot, created_at, is_used, user_id)
+           SELECT otp, name, res_date, time_slot, created_at, is_used, user_id FROM reservations ORDER BY created_at''',
+        '''DROP TABLE reservations''',
+        '''ALTER TABLE reservations_new RENAME TO reservations''',
+        '''CREATE UNIQUE INDEX idx_reservations_active_otp ON reservations(otp) WHERE is_used = 0''',
+        '''CREATE INDEX idx_reservations_user_active ON reservations(user_id, created_at) WHERE is_used = 0''',
+        '''CREATE INDEX idx_reservations_created ON reservations(created_at)''',
+    ]),
+    (6, "index for expiring no-shows by slot", [
+        '''CREATE INDEX IF NOT EXISTS idx_reservations_slot ON reservations(res_date, time_slot) WHERE is_used = 0''',
+    ]),
+    (7, "change feed for multi-worker shared state", [
+        # AUTOINCREMENT: seqs must never be reused after old rows are pruned
+        '''CREATE TABLE IF NOT EXISTS state_events (seq INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT, created REAL)''',
+    ]),
+    (8, "index for the admin reservations table filtered by date", [
+        # Entries are (res_date, id), so a date's page comes out already in id order
+        '''CREATE INDEX IF NOT EXISTS idx_reservations_date ON reservations(res_date)''',
+    ]),
+    (9, "zones: per-room capacity and seats, zone_id on events, bookings, devices and rollups", [
+        '''CREATE TABLE zones (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, total_capacity INTEGER NOT NULL, available_seats INTEGER NOT NULL)''',
+        _seed_main_zone,
+        # Existing rows all belong to the original library; ADD COLUMN with a default doesn't rewrite the table
+        '''ALTER TABLE logs ADD COLUMN zone_id INTEGER NOT NULL DEFAULT 1''',
+        '''ALTER TABLE reservations ADD COLUMN zone_id INTEGER NOT NULL DEFAULT 1''',
+        '''ALTER TABLE devices ADD COLUMN zone_id INTEGER NOT NULL DEFAULT 1''',
+        '''ALTER TABLE occupancy_rollups RENAME TO occupancy_rollups_v3''',
+        rollups.CREATE_TABLE,
+        '''INSERT INTO occupancy_rollups SELECT 1, * FROM occupancy_rollups_v3''',
+        '''DROP TABLE occupancy_rollups_v3''',
+    ]),
+    (10, "epoch seconds next to the display timestamps of logs and reservations", [
+        # Range scans, retention and rollup rebuilds compare integers instead of parsing text
+        '''ALTER TABLE logs ADD COLUMN ts INTEGER''',
+        '''ALTER TABLE reservations ADD COLUMN created_ts INTEGER''',
+        _fill_epoch_columns,
+        '''DROP INDEX IF EXISTS idx_logs_timestamp''',
+        '''CREATE INDEX idx_logs_ts ON logs(ts)''',
+        '''DROP INDEX IF EXISTS idx_reservations_user_active''',
+        '''CREATE INDEX idx_reservations_user_active ON reservations(user_id, created_ts) WHERE is_used = 0''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    # Returns the list of (number, name) steps that were applied
+    applied = []
+    current = schema_version(conn)
+    for number, name, steps in MIGRATIONS:
+        if number <= current: continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append((number, name))
+    return applied
+
+
+# --- QUERY PLAN CHECK ---
+# Queries that run on every booking, poll or login. None of them may fall
+# back to scanning a whole table or sorting in a temp b-tree; run
+# `flask --app app:create_app check-query-plans` (exits 1 on a regression).
+
+HOT_QUERIES = [
+    'SELECT count(*) FROM reservations WHERE is_used = 0',
+    'SELECT * FROM reservations WHERE user_id = ? AND is_used = 0 ORDER BY created_ts DESC',
+    'SELECT * FROM reservations WHERE otp = ? AND user_id = ? AND is_used = 0',
+    'SELECT * FROM reservations WHERE otp = ? AND is_used = 0',
+    'UPDATE reservations SET is_used = 1 WHERE otp = ? AND is_used = 0 AND zone_id = ?',
+    'SELECT count(*) FROM reservations WHERE res_date = ? AND time_slot = ? AND zone_id = ? AND is_used = 0',
+    'DELETE FROM reservations WHERE id = ?',
+    'UPDATE reservations SET is_used = 2 WHERE is_used = 0 AND (res_date < ? OR (res_date = ? AND time_slot IN (?, ?)))',
+    'SELECT * FROM reservations WHERE id < ? ORDER BY id DESC LIMIT ?',
+    'SELECT * FROM reservations WHERE res_date = ? AND id < ? ORDER BY id DESC LIMIT ?',
+    'SELECT * FROM users WHERE id < ? ORDER BY id DESC LIMIT ?',
+    'SELECT * FROM staff WHERE is_present = 1',
+    'SELECT * FROM users WHERE username = ?',
+    "SELECT * FROM users WHERE role = 'admin'",
+    'SELECT id, timestamp, event_type, user_type, occupancy, zone_id FROM logs WHERE ts < ? ORDER BY ts LIMIT ?',
+    'SELECT * FROM occupancy_rollups WHERE zone_id = ? AND granularity = ? AND bucket >= ? AND bucket < ? ORDER BY bucket',
+]
+
+_FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+
+
+def check_query_plans(conn):
+    # Returns [(sql, plan detail), ...] for every hot query that regressed
+    problems = []
+    for sql in HOT_QUERIES:
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, (None,) * sql.count('?')):
+            detail = row[3]
+            if _FULL_SCAN.match(detail) or detail.startswith('USE TEMP B-TREE'):
+                problems.append((sql, detail))
+    return problems
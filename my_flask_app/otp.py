@@ -0,0 +1,63 @@
+import secrets
+import threading
+
+# --- OTP ALLOCATOR ---
+# Booking codes are 4 digits typed on the door keypad, so only 9000 exist.
+# Instead of guessing with randint and hoping the INSERT doesn't collide, we
+# keep every code that is free right now in a list and hand out a random one
+# in O(1) (swap with the last entry and pop). The codes of unused bookings
+# stay in `active`, which /verify_otp checks before touching the database.
+
+OTP_MIN, OTP_MAX = 1000, 9999
+
+
+class OtpAllocator:
+    def __init__(self, low=OTP_MIN, high=OTP_MAX):
+        self.low, self.high = low, high
+        self._lock = threading.Lock()
+        self._free = []
+        self._pos = {}  # code -> index in _free
+        self.active = set()
+        self.load(())
+
+    def load(self, active_codes):
+        with self._lock:
+            self.active = {c for c in active_codes if c is not None}
+            self._free = [str(c) for c in range(self.low, self.high + 1) if str(c) not in self.active]
+            self._pos = {c: i for i, c in enumerate(self._free)}
+
+    def _take(self, code):
+        i = self._pos.pop(code)
+        last = self._free.pop()
+        if last != code:
+            self._free[i] = last
+            self._pos[last] = i
+
+    def issue(self):
+        # Returns a code no unused booking has, or None when all of them are taken
+        with self._lock:
+            if not self._free: return None
+            code = self._free[secrets.randbelow(len(self._free))]
+            self._take(code)
+            self.active.add(code)
+            return code
+
+    def claim(self, code):
+        # Someone else (another worker, an old row) already holds `code`
+        with self._lock:
+            if code in self._pos: self._take(code)
+            self.active.add(code)
+
+    def release(self, code):
+        # The booking was used, cancelled or deleted: the code can go out again
+        with self._lock:
+            if code not in self.active: return
+            self.active.discard(code)
+            self._pos[code] = len(self._free)
+            self._free.append(code)
+
+    def is_active(self, code):
+        return code in self.active
+
+    def __len__(self):
+        return len(self.active)
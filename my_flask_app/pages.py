@@ -0,0 +1,137 @@
+import csv
+import io
+
+import slots
+
+# --- ADMIN TABLES ---
+# The admin lists (reservations, users, staff cards) are read one page at a
+# time, newest first, with the last row's key as the cursor (?before=<id>)
+# instead of OFFSET: a deep page costs the same as the first one, and rows
+# added meanwhile don't shift what the next page shows. Filters come from the
+# query string and are normalised here, so they can be part of a cache key;
+# page links carry only the args named in QUERY_ARGS.
+# CSV exports walk the same pages and stream them out chunk by chunk.
+
+PAGE_SIZE = 50
+EXPORT_CHUNK = 500
+RES_STATUS = {'active': 0, 'used': 1, 'expired': 2}
+QUERY_ARGS = ('date', 'slot', 'status', 'q', 'zone', 'before', 'role', 'staff_q', 'staff_status', 'staff_after')
+USER_ROLES = ('admin', 'student')
+
+
+def int_arg(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _prefix(text):
+    # LIKE pattern matching `text` literally at the start
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _text(args, name):
+    return (args.get(name) or '').strip()[:64]
+
+
+def panel_key(name, args):
+    # Cache key for one of the admin panel's tables. Its page links keep the other table's filters
+    # and page, so both tables' state is part of it.
+    return (name, tuple(sorted(reservation_filters(args).items())), int_arg(args.get('before')),
+            tuple(sorted(staff_filters(args).items())), args.get('staff_after') or None)
+
+
+def _page(conn, table, clauses, before, limit):
+    # clauses: [(sql, params)]; returns (rows, cursor for the next page or None)
+    if before is not None: clauses = clauses + [('id < ?', (before,))]
+    sql = f'SELECT * FROM {table}'
+    if clauses: sql += ' WHERE ' + ' AND '.join(c for c, _ in clauses)
+    params = [p for _, ps in clauses for p in ps]
+    rows = conn.execute(sql + ' ORDER BY id DESC LIMIT ?', params + [limit + 1]).fetchall()
+    return rows[:limit], (rows[limit - 1]['id'] if len(rows) > limit else None)
+
+
+# --- RESERVATIONS ---
+def reservation_filters(args):
+    filters = {}
+    if _text(args, 'date'): filters['date'] = _text(args, 'date')
+    if args.get('slot') in slots.SLOT_BOUNDS: filters['slot'] = args['slot']
+    if args.get('status') in RES_STATUS: filters['status'] = args['status']
+    if _text(args, 'q'): filters['q'] = _text(args, 'q')
+    if int_arg(args.get('zone')) is not None: filters['zone'] = int_arg(args['zone'])
+    return filters
+
+
+def reservations_page(conn, filters, before=None, limit=PAGE_SIZE):
+    clauses = []
+    if 'date' in filters: clauses.append(('res_date = ?', (filters['date'],)))
+    if 'slot' in filters: clauses.append(('time_slot = ?', (filters['slot'],)))
+    if 'status' in filters: clauses.append(('is_used = ?', (RES_STATUS[filters['status']],)))
+    if 'zone' in filters: clauses.append(('zone_id = ?', (filters['zone'],)))
+    if 'q' in filters: clauses.append(("(name LIKE ? ESCAPE '\\' OR otp = ?)", (_prefix(filters['q']), filters['q'])))
+    return _page(conn, 'reservations', clauses, before, limit)
+
+
+# --- USERS ---
+def user_filters(args):
+    filters = {}
+    if args.get('role') in USER_ROLES: filters['role'] = args['role']
+    if _text(args, 'q'): filters['q'] = _text(args, 'q')
+    return filters
+
+
+def users_page(conn, filters, before=None, limit=PAGE_SIZE):
+    clauses = []
+    if 'role' in filters: clauses.append(('role = ?', (filters['role'],)))
+    if 'q' in filters: clauses.append(("username LIKE ? ESCAPE '\\'", (_prefix(filters['q']),)))
+    return _page(conn, 'users', clauses, before, limit)
+
+
+# --- STAFF CARDS ---
+# The roster lives in memory (LiveState), so its pages are cut from there,
+# ordered by card UID. Its query args are prefixed, as it shares the admin
+# panel's URL with the reservations table.
+def staff_filters(args):
+    filters = {}
+    if _text(args, 'staff_q'): filters['q'] = _text(args, 'staff_q').lower()
+    if args.get('staff_status') in ('in', 'out'): filters['status'] = args['staff_status']
+    return filters
+
+
+def staff_page(staff, filters, after=None, limit=PAGE_SIZE):
+    q, status = filters.get('q'), filters.get('status')
+    rows = sorted((p for p in staff
+                   if (not q or q in p['uid'].lower() or q in (p['name'] or '').lower())
+                   and (not status or bool(p['is_present']) == (status == 'in'))
+                   and (after is None or p['uid'] > after)), key=lambda p: p['uid'])
+    return rows[:limit], (rows[limit - 1]['uid'] if len(rows) > limit else None)
+
+
+# --- CSV EXPORT ---
+def _cell(value):
+    # Spreadsheets run cells starting with these as formulas; names come from users
+    if value is None: return ''
+    value = str(value)
+    return "'" + value if value[:1] in ('=', '+', '-', '@') else value
+
+
+def walk(pool, page, filters):
+    # Every matching row, one chunk per pooled connection, so no read is held open while the client downloads
+    before = None
+    while True:
+        with pool.connection() as conn:
+            rows, before = page(conn, filters, before, EXPORT_CHUNK)
+        yield rows
+        if before is None: return
+
+
+def stream_csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows([_cell(row[c]) for c in columns] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
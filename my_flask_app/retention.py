@@ -0,0 +1,103 @@
+import csv
+import gzip
+import io
+import logging
+import os
+import time
+
+import rollups
+
+# --- LOG RETENTION ---
+# Raw doorway events older than the retention window are already summarised
+# in the hour/day rollups. This moves them out of library.db into per-day
+# gzip'd CSV files under the archive directory, then deletes them a small
+# batch at a time, so each transaction holds the write lock for milliseconds
+# and /update_data never waits long behind it.
+
+log = logging.getLogger(__name__)
+
+CSV_HEADER = ['id', 'timestamp', 'event_type', 'user_type', 'occupancy', 'zone_id']
+LEASE_KEY = 'retention_lease'
+
+
+def _acquire_lease(pool, ttl):
+    # Only one process (or gunicorn worker) compacts at a time
+    now = time.time()
+    with pool.connection() as conn:
+        conn.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', (LEASE_KEY, '0'))
+        cur = conn.execute('UPDATE settings SET value = ? WHERE key = ? AND CAST(value AS REAL) < ?', (str(now + ttl), LEASE_KEY, now))
+        return cur.rowcount == 1
+
+
+def _release_lease(pool):
+    with pool.connection() as conn:
+        conn.execute('UPDATE settings SET value = ? WHERE key = ?', ('0', LEASE_KEY))
+
+
+def _archive(rows, archive_dir):
+    # Appends rows to logs-YYYY-MM-DD.csv.gz (a new gzip member per batch)
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row['timestamp'][:10], []).append(row)
+    for day, day_rows in by_day.items():
+        path = os.path.join(archive_dir, f'logs-{day}.csv.gz')
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if not os.path.exists(path): writer.writerow(CSV_HEADER)
+        writer.writerows(tuple(r) for r in day_rows)
+        with gzip.open(path, 'at', newline='') as f:
+            f.write(buf.getvalue())
+
+
+def compact(pool, retention_days, archive_dir, batch_size=500, pause=0.05, vacuum_pages=500, lease_ttl=3600):
+    # Returns the number of raw log rows archived and deleted (None if another process holds the lease)
+    if not _acquire_lease(pool, lease_ttl): return None
+    try:
+        os.makedirs(archive_dir, exist_ok=True)
+        cutoff_ts = int(time.time()) - retention_days * 86400
+        total = 0
+        while True:
+            with pool.connection() as conn:
+                rows = conn.execute('SELECT id, timestamp, event_type, user_type, occupancy, zone_id FROM logs WHERE ts < ? ORDER BY ts LIMIT ?',
+                                    (cutoff_ts, batch_size)).fetchall()
+                if not rows: break
+                # Archive first: a crash between the two can duplicate an archived batch, never lose one
+                _archive(rows, archive_dir)
+                conn.execute(f'DELETE FROM logs WHERE id IN ({",".join("?" * len(rows))})', [r['id'] for r in rows])
+            total += len(rows)
+            time.sleep(pause)  # let queued ingest batches in between
+
+        # Minute buckets past the window go too; hour and day buckets are kept forever
+        day = rollups.GRANULARITIES['day']
+        with pool.connection() as conn:
+            zone_ids = [r[0] for r in conn.execute('SELECT DISTINCT zone_id FROM occupancy_rollups')]
+        for zone_id in zone_ids:
+            while True:
+                with pool.connection() as conn:
+                    oldest = conn.execute("SELECT min(bucket) FROM occupancy_rollups WHERE zone_id = ? AND granularity = 'minute'", (zone_id,)).fetchone()[0]
+                    if oldest is None or oldest >= cutoff_ts: break
+                    conn.execute("DELETE FROM occupancy_rollups WHERE zone_id = ? AND granularity = 'minute' AND bucket < ?", (zone_id, min(oldest + day, cutoff_ts)))
+                time.sleep(pause)
+
+        with pool.connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:  # INCREMENTAL
+                free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                for _ in range(-(-free_pages // vacuum_pages)):
+                    # executescript steps the pragma to completion; execute() frees one page per call
+                    conn.executescript(f'PRAGMA incremental_vacuum({vacuum_pages})')
+                    time.sleep(pause)
+        if total: log.info("Archived and removed %d log rows older than %s", total, rollups.to_local_text(cutoff_ts))
+        return total
+    finally:
+        _release_lease(pool)
+
+
+def convert_to_incremental_vacuum(pool):
+    # One-off for databases created before auto_vacuum was switched on; rewrites the whole file
+    with pool.connection() as conn:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn = pool.acquire()
+    try:
+        conn.execute('VACUUM')
+    finally:
+        pool.release(conn)
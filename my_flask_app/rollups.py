@@ -0,0 +1,111 @@
+import calendar
+import time
+from datetime import datetime
+
+from state import SL_TZ
+from zones import DEFAULT_ZONE
+
+# --- OCCUPANCY ROLLUPS ---
+# Per-minute, per-hour and per-day summaries of the doorway events in `logs`.
+# The ingest writer folds each batch in as it commits it, so history queries
+# read one row per bucket instead of scanning raw events. Each zone has its
+# own buckets, since occupancy is counted per zone.
+
+GRANULARITIES = {'minute': 60, 'hour': 3600, 'day': 86400}
+# Sri Lanka has no DST, so one fixed offset (today's) lines buckets up with local midnight/hours
+UTC_OFFSET = int(datetime.now(SL_TZ).utcoffset().total_seconds())
+MAX_BUCKETS = 1500  # per /api/occupancy_history request
+
+CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS occupancy_rollups (
+    zone_id INTEGER, granularity TEXT, bucket INTEGER, min_occ INTEGER, max_occ INTEGER, sum_occ INTEGER, samples INTEGER,
+    entries INTEGER, exits INTEGER, staff_events INTEGER, student_events INTEGER,
+    PRIMARY KEY (zone_id, granularity, bucket)) WITHOUT ROWID'''
+
+UPSERT = '''INSERT INTO occupancy_rollups (zone_id, granularity, bucket, min_occ, max_occ, sum_occ, samples, entries, exits, staff_events, student_events)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (zone_id, granularity, bucket) DO UPDATE SET
+        min_occ = min(min_occ, excluded.min_occ), max_occ = max(max_occ, excluded.max_occ),
+        sum_occ = sum_occ + excluded.sum_occ, samples = samples + excluded.samples,
+        entries = entries + excluded.entries, exits = exits + excluded.exits,
+        staff_events = staff_events + excluded.staff_events, student_events = student_events + excluded.student_events'''
+
+
+def bucket_start(ts, width):
+    return int(ts - (ts + UTC_OFFSET) % width)
+
+
+def to_local_text(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts + UTC_OFFSET))
+
+
+def parse_local(text):
+    # Accepts epoch seconds or local 'YYYY-MM-DD[ HH:MM[:SS]]'
+    text = text.strip()
+    if text.isdigit(): return int(text)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(text, fmt)) - UTC_OFFSET
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognised time: {text}")
+
+
+def apply(conn, events):
+    # events: iterable of (ts, event_type, user_type, occupancy, zone_id). Aggregates
+    # in memory first so a batch costs one upsert per touched bucket.
+    buckets = {}
+    for ts, event_type, user_type, occupancy, zone_id in events:
+        for granularity, width in GRANULARITIES.items():
+            key = (zone_id, granularity, bucket_start(ts, width))
+            b = buckets.get(key)
+            if b is None:
+                b = buckets[key] = [occupancy, occupancy, 0, 0, 0, 0, 0, 0]
+            b[0] = min(b[0], occupancy)
+            b[1] = max(b[1], occupancy)
+            b[2] += occupancy
+            b[3] += 1
+            b[4] += event_type == "ENTRY"
+            b[5] += event_type == "EXIT"
+            b[6] += user_type == "STAFF"
+            b[7] += user_type != "STAFF"
+    conn.executemany(UPSERT, [key + tuple(b) for key, b in buckets.items()])
+
+
+def backfill(conn):
+    # Rebuilds the rollups from `logs` with one GROUP BY per zone and granularity. Retention has
+    # deleted the raw events before each zone's oldest log, and the hour/day buckets are all that is
+    # left of them, so only buckets from there on are replaced. The bucket holding the oldest log may
+    # hold archived events too: if it has a rollup already, that one is kept as it is.
+    starts = conn.execute('SELECT zone_id, min(ts) FROM logs WHERE ts IS NOT NULL GROUP BY zone_id').fetchall()
+    for zone_id, oldest in starts:
+        for granularity, width in GRANULARITIES.items():
+            start = bucket_start(oldest, width)
+            if start < oldest and conn.execute('SELECT 1 FROM occupancy_rollups WHERE zone_id = ? AND granularity = ? AND bucket = ?',
+                                               (zone_id, granularity, start)).fetchone():
+                start += width
+            conn.execute('DELETE FROM occupancy_rollups WHERE zone_id = ? AND granularity = ? AND bucket >= ?', (zone_id, granularity, start))
+            conn.execute('''INSERT INTO occupancy_rollups (zone_id, granularity, bucket, min_occ, max_occ, sum_occ, samples, entries, exits, staff_events, student_events)
+                SELECT zone_id, ?, ts - (ts + ?) % ?, min(occupancy), max(occupancy), sum(occupancy), count(*),
+                       sum(event_type = 'ENTRY'), sum(event_type = 'EXIT'), sum(user_type = 'STAFF'), sum(user_type != 'STAFF')
+                FROM (SELECT ts, event_type, user_type, max(0, occupancy) AS occupancy, zone_id FROM logs WHERE zone_id = ? AND ts >= ?)
+                GROUP BY 3''', (granularity, UTC_OFFSET, width, zone_id, start))
+
+
+def history(conn, granularity, start, end, zone_id=DEFAULT_ZONE):
+    width = GRANULARITIES[granularity]
+    start = bucket_start(start, width)
+    if (end - start) / width > MAX_BUCKETS:
+        raise ValueError(f"Range too large: at most {MAX_BUCKETS} {granularity} buckets per request")
+    rows = conn.execute('''SELECT bucket, min_occ, max_occ, sum_occ, samples, entries, exits, staff_events, student_events
+        FROM occupancy_rollups WHERE zone_id = ? AND granularity = ? AND bucket >= ? AND bucket < ? ORDER BY bucket''', (zone_id, granularity, start, end))
+    return [{
+        "start": to_local_text(r['bucket']),
+        "ts": r['bucket'],
+        "min": r['min_occ'],
+        "max": r['max_occ'],
+        "avg": round(r['sum_occ'] / r['samples'], 2),
+        "entries": r['entries'],
+        "exits": r['exits'],
+        "staff_events": r['staff_events'],
+        "student_events": r['student_events'],
+    } for r in rows]
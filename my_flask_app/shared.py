@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+
+# --- SHARED STATE ---
+# LiveState (state.py) is a per-process copy. With a single process -- the dev
+# server, or one gunicorn worker -- that copy is the whole truth: LocalBackend.
+# With several workers, SqliteBackend has every write leave a row in
+# state_events, in the same transaction as the change itself. Each worker
+# polls that table and reloads the parts of its LiveState that changed, then
+# pushes them to its own SSE subscribers. library.db is the broker, so no
+# extra service is needed. Topics: seats, staff, reservations, announcement, devices.
+
+log = logging.getLogger(__name__)
+
+
+class LocalBackend:
+    shared = False
+
+    def notify(self, conn, *topics):
+        pass
+
+    def start(self, on_change):
+        pass
+
+
+class SqliteBackend:
+    shared = True
+
+    def __init__(self, pool, interval=0.1, keep_seconds=300):
+        self.pool = pool
+        self.interval = interval  # how often each worker looks for changes
+        self.keep_seconds = keep_seconds  # a worker stalled longer than this misses changes
+        self.on_change = None  # callback(set of topics), from the poller thread
+        self._last = 0
+        self._thread = None
+        self._mine = set()  # seqs this process wrote; its LiveState already has those changes
+        self._mine_lock = threading.Lock()
+
+    def notify(self, conn, *topics):
+        # Call inside the write's own transaction, so other workers never reload too early
+        now = time.time()
+        seqs = [conn.execute('INSERT INTO state_events (topic, created) VALUES (?, ?) RETURNING seq', (t, now)).fetchone()[0] for t in topics]
+        with self._mine_lock: self._mine.update(seqs)
+
+    def start(self, on_change):
+        if self._thread is not None: return
+        self.on_change = on_change
+        with self.pool.connection() as conn:
+            self._last = conn.execute('SELECT coalesce(max(seq), 0) FROM state_events').fetchone()[0]
+        self._thread = threading.Thread(target=self._run, name='shared-state', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last_prune = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.pool.connection() as conn:
+                    rows = conn.execute('SELECT seq, topic FROM state_events WHERE seq > ? ORDER BY seq', (self._last,)).fetchall()
+                    if time.monotonic() - last_prune > self.keep_seconds:
+                        conn.execute('DELETE FROM state_events WHERE created < ?', (time.time() - self.keep_seconds,))
+                        last_prune = time.monotonic()
+                if rows:
+                    self._last = rows[-1][0]
+                    with self._mine_lock:
+                        topics = {topic for seq, topic in rows if seq not in self._mine}
+                        self._mine = {seq for seq in self._mine if seq > self._last}  # also drops seqs of rolled-back writes
+                    if topics: self.on_change(topics)  # many changes since the last look = one reload each
+            except Exception:
+                log.exception("Shared state poll failed")
+
+
+def make_backend(name, pool):
+    if name == 'local': return LocalBackend()
+    if name == 'sqlite': return SqliteBackend(pool)
+    raise ValueError(f"Unknown shared state backend: {name} (expected 'local' or 'sqlite')")
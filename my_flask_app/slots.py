@@ -0,0 +1,79 @@
+import threading
+from datetime import datetime
+
+# --- RESERVATION SLOTS ---
+# A booking only holds a seat during its own slot on its own date. Counters
+# per (date, slot) are kept in memory, so booking can check the slot is not
+# full and the dashboard can read the current slot's held seats directly.
+# Bookings nobody checked in for are expired once their slot is over.
+
+SLOTS = ['08:00 AM - 12:00 PM', '12:00 PM - 04:00 PM', '04:00 PM - 08:00 PM']  # same labels as the booking form
+
+
+def _minutes(text):
+    t = datetime.strptime(text.strip(), "%I:%M %p")
+    return t.hour * 60 + t.minute
+
+SLOT_BOUNDS = {label: tuple(_minutes(part) for part in label.split(' - ')) for label in SLOTS}  # label -> (start, end) minutes
+
+
+def _now_minutes(local_now):
+    return local_now.hour * 60 + local_now.minute
+
+
+def current_slot(local_now):
+    # The slot running at local_now, or None outside opening hours
+    now = _now_minutes(local_now)
+    for label, (start, end) in SLOT_BOUNDS.items():
+        if start <= now < end: return label
+    return None
+
+
+def ended_slots(local_now):
+    now = _now_minutes(local_now)
+    return [label for label, (start, end) in SLOT_BOUNDS.items() if end <= now]
+
+
+def is_open(res_date, slot, local_now):
+    # Known slot that hasn't finished yet
+    if slot not in SLOT_BOUNDS: return False
+    try:
+        day = datetime.strptime(res_date or '', "%Y-%m-%d").date()
+    except ValueError:
+        return False
+    today = local_now.date()
+    return day > today or (day == today and slot not in ended_slots(local_now))
+
+
+class SlotCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.held = {}  # (res_date, slot) -> unused bookings
+
+    def load(self, rows):
+        # rows: (res_date, time_slot) of every unused booking
+        held = {}
+        for key in rows:
+            key = tuple(key)
+            held[key] = held.get(key, 0) + 1
+        with self._lock:
+            self.held = held
+
+    def hold(self, res_date, slot, limit):
+        # Takes a seat in the slot unless `limit` are already held
+        with self._lock:
+            count = self.held.get((res_date, slot), 0)
+            if count >= limit: return False
+            self.held[(res_date, slot)] = count + 1
+            return True
+
+    def release(self, res_date, slot):
+        with self._lock:
+            count = self.held.get((res_date, slot), 0) - 1
+            if count > 0: self.held[(res_date, slot)] = count
+            else: self.held.pop((res_date, slot), None)
+
+    def held_now(self, local_now):
+        slot = current_slot(local_now)
+        if slot is None: return 0
+        return self.held.get((local_now.strftime("%Y-%m-%d"), slot), 0)
@@ -0,0 +1,47 @@
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+# --- RENDERED SNAPSHOTS ---
+# A page or JSON body as rendered for one live.version, with its ETag and
+# compressed copies. Each encoding is compressed the first time a client
+# asks for it and then kept until the version moves on, so a lobby full of
+# screens on the same page costs one render and one gzip per change, not
+# one per hit. Brotli is offered when the module is installed.
+
+MIN_COMPRESS = 512  # bytes; smaller bodies aren't worth a Content-Encoding
+
+
+class Snapshot:
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body.encode() if isinstance(body, str) else body
+        self.etag = hashlib.blake2b(self.body, digest_size=8).hexdigest()
+        self._lock = threading.Lock()
+        self._encoded = {}  # encoding -> compressed body
+
+    def encoded(self, encoding):
+        # (body, etag) in 'identity', 'gzip' or 'br'; each encoding gets its own ETag
+        if encoding == 'identity': return self.body, self.etag
+        with self._lock:
+            body = self._encoded.get(encoding)
+            if body is None: body = self._encoded[encoding] = _compress(encoding, self.body)
+        return body, f'{self.etag}-{encoding}'
+
+
+def _compress(encoding, body):
+    if encoding == 'br': return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def pick_encoding(accept_encodings, size):
+    # accept_encodings: werkzeug's request.accept_encodings
+    if size < MIN_COMPRESS: return 'identity'
+    if brotli and accept_encodings['br']: return 'br'
+    if accept_encodings['gzip']: return 'gzip'
+    return 'identity'
@@ -0,0 +1,320 @@
+import threading
+from collections import deque
+from datetime import datetime
+
+import pytz
+
+from heartbeat import HeartbeatRegistry, DEFAULT_DEVICE
+from otp import OtpAllocator
+from slots import SlotCounters
+from zones import DEFAULT_ZONE, Zone, seat_stats
+
+# --- LIVE STATE ---
+# One process-wide copy of everything the dashboard and admin pages poll for.
+# Write routes update it right after they touch the database, so the read
+# endpoints can answer straight from memory. `version` goes up on every
+# change, so pollers can be told "nothing new" without rebuilding anything.
+
+ONLINE_WINDOW = 65  # seconds without a ping before an ESP32 counts as offline
+ROSTER_JOURNAL_SIZE = 1000  # roster changes kept for delta syncs; older devices get a full snapshot
+SL_TZ = pytz.timezone('Asia/Colombo')
+
+
+def save_roster_changes(conn, changes):
+    # changes: [(uid, is_present or None if removed), ...]. The database numbers them,
+    # so every worker process agrees on the roster version; LiveState.sync_roster
+    # picks them up after the commit. Only the last ROSTER_JOURNAL_SIZE rows are kept.
+    conn.executemany('INSERT INTO staff_changes (uid, is_present) VALUES (?, ?)', changes)
+    conn.execute('DELETE FROM staff_changes WHERE seq <= (SELECT max(seq) FROM staff_changes) - ?', (ROSTER_JOURNAL_SIZE,))
+
+
+class LiveState:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = 1
+        self.zones = {}  # zone id -> Zone (its own capacity, seats and slot counters)
+        self.total_capacity = 0  # campus totals: sums over the zones, kept up to date by every zone write
+        self.available_seats = 0
+        self.otps = OtpAllocator()  # codes of unused bookings + the free pool (campus-wide)
+        self.slots = SlotCounters()  # unused bookings per (date, slot), campus-wide
+        self.announcement = None
+        self.announcement_time = None
+        self.devices = HeartbeatRegistry(online_window=ONLINE_WINDOW)
+        self.staff = {}  # uid -> staff row (dict), in table order
+        self.staff_present = 0
+        # Door units sync the roster by version: the seq of the last staff_changes row
+        self.roster_version = 0
+        self.roster_journal = deque(maxlen=ROSTER_JOURNAL_SIZE)  # (seq, uid, is_present or None if removed)
+        self._roster_snapshot = (None, '')
+
+    # --- LOADING ---
+    def load(self, conn):
+        with self._lock:
+            self.refresh_seats(conn)
+            self.refresh_staff(conn)
+            self.refresh_reservations(conn)
+            self.refresh_announcement(conn)
+            rows = [tuple(r) for r in conn.execute('SELECT id, last_seen_ts, zone_id FROM devices')]
+            if not rows:
+                # Databases from before per-device heartbeats only have the single last_ping setting
+                row = conn.execute('SELECT value FROM settings WHERE key="last_ping"').fetchone()
+                if row:
+                    try:
+                        rows = [(DEFAULT_DEVICE, SL_TZ.localize(datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")).timestamp(), DEFAULT_ZONE)]
+                    except ValueError:
+                        pass
+            self.devices.load(rows)
+            self.version += 1
+
+    # The refresh_* methods reload one part from the database; besides startup they
+    # run when another worker process changed that part (see shared.py)
+    def refresh_seats(self, conn):
+        # Every zone's capacity and live seats (also picks up zones added elsewhere)
+        rows = conn.execute('SELECT id, name, total_capacity, available_seats FROM zones ORDER BY id').fetchall()
+        with self._lock:
+            zones = {}
+            for zone_id, name, total, available in rows:
+                zone = self.zones.get(zone_id) or Zone(zone_id, name, total, available)  # existing ones keep their slot counters
+                zone.name, zone.total_capacity, zone.available_seats = name, total, available
+                zones[zone_id] = zone
+            self.zones = zones
+            self._sum_zones()
+            self.version += 1
+
+    def _sum_zones(self):
+        self.total_capacity = sum(z.total_capacity for z in self.zones.values())
+        self.available_seats = sum(z.available_seats for z in self.zones.values())
+
+    def refresh_staff(self, conn):
+        rows = conn.execute('SELECT uid, name, is_present, last_seen FROM staff').fetchall()
+        with self._lock:
+            self.staff = {}
+            for uid, name, is_present, last_seen in rows:
+                self.staff[uid] = {'uid': uid, 'name': name, 'is_present': is_present, 'last_seen': last_seen}
+            self.staff_present = sum(1 for p in self.staff.values() if p['is_present'])
+            self.sync_roster(conn)
+
+    def sync_roster(self, conn):
+        # Appends staff_changes rows we haven't seen yet to the journal
+        with self._lock:
+            rows = conn.execute('SELECT seq, uid, is_present FROM staff_changes WHERE seq > ? ORDER BY seq DESC LIMIT ?',
+                                (self.roster_version, ROSTER_JOURNAL_SIZE)).fetchall()
+            if not rows: return
+            self.roster_journal.extend(tuple(r) for r in reversed(rows))
+            self.roster_version = rows[0][0]
+            self.version += 1
+
+    def refresh_reservations(self, conn):
+        rows = conn.execute('SELECT otp, res_date, time_slot, zone_id FROM reservations WHERE is_used = 0').fetchall()
+        by_zone = {}
+        for r in rows: by_zone.setdefault(r[3], []).append((r[1], r[2]))
+        with self._lock:
+            self.otps.load(r[0] for r in rows)
+            self.slots.load((r[1], r[2]) for r in rows)
+            for zone in self.zones.values(): zone.slots.load(by_zone.get(zone.id, ()))
+            self.version += 1
+
+    def refresh_announcement(self, conn):
+        row = conn.execute('SELECT message, created_at FROM announcements ORDER BY id DESC LIMIT 1').fetchone()
+        with self._lock:
+            self.announcement = row[0] if row else None
+            self.announcement_time = row[1] if row else None
+            self.version += 1
+
+    # --- WRITES ---
+    def bump(self):
+        with self._lock:
+            self.version += 1
+
+    # Zone writes adjust the campus totals by the difference, so they stay O(1) per zone
+    def set_seats(self, available, zone_id=DEFAULT_ZONE):
+        with self._lock:
+            zone = self.zones[zone_id]
+            self.available_seats += available - zone.available_seats
+            zone.available_seats = available
+            self.version += 1
+
+    def set_capacity(self, total, available, zone_id=DEFAULT_ZONE):
+        with self._lock:
+            zone = self.zones[zone_id]
+            self.total_capacity += total - zone.total_capacity
+            self.available_seats += available - zone.available_seats
+            zone.total_capacity, zone.available_seats = total, available
+            self.version += 1
+
+    def add_zone(self, zone_id, name, total, available):
+        with self._lock:
+            self.zones[zone_id] = Zone(zone_id, name, total, available)
+            self._sum_zones()
+            self.version += 1
+
+    def hold_seat(self, zone_id, res_date, slot, limit):
+        # False when the zone's slot already has `limit` bookings
+        with self._lock:
+            zone = self.zones.get(zone_id)
+            if zone is None or not zone.slots.hold(res_date, slot, limit): return False
+            self.slots.hold(res_date, slot, float('inf'))
+            self.version += 1
+            return True
+
+    def release_booking(self, zone_id, res_date, slot, otp=None):
+        # The booking was used or cancelled (or never got saved)
+        with self._lock:
+            zone = self.zones.get(zone_id)
+            if zone is not None: zone.slots.release(res_date, slot)
+            self.slots.release(res_date, slot)
+            if otp: self.otps.release(otp)
+            self.version += 1
+
+    def set_announcement(self, message, created_at):
+        with self._lock:
+            self.announcement = message
+            self.announcement_time = created_at
+            self.version += 1
+
+    # Staff writes also go into staff_changes (save_roster_changes) in the same
+    # transaction as the staff row; the roster version moves on in sync_roster.
+    def set_staff_presence(self, uid, is_present, last_seen):
+        # Returns False for an unknown card
+        with self._lock:
+            person = self.staff.get(uid)
+            if person is None: return False
+            self.staff_present += (1 if is_present else 0) - (1 if person['is_present'] else 0)
+            person['is_present'] = is_present
+            person['last_seen'] = last_seen
+            self.version += 1
+            return True
+
+    def upsert_staff(self, uid, name, is_present, last_seen):
+        # INSERT OR REPLACE moves the row to the end of the table, so do the same here
+        with self._lock:
+            self._drop_staff(uid)
+            self.staff[uid] = {'uid': uid, 'name': name, 'is_present': is_present, 'last_seen': last_seen}
+            if is_present: self.staff_present += 1
+            self.version += 1
+
+    def rename_staff(self, uid, name):
+        with self._lock:
+            if uid in self.staff: self.staff[uid]['name'] = name
+            self.version += 1
+
+    def _drop_staff(self, uid):
+        person = self.staff.pop(uid, None)
+        if person and person['is_present']: self.staff_present -= 1
+        return person
+
+    def remove_staff(self, uid):
+        with self._lock:
+            self._drop_staff(uid)
+            self.version += 1
+
+    # --- READS ---
+    def system_status(self, zone_id=None):
+        return 1 if self.devices.any_online(zone_id) else 0  # Online if any door unit (of the zone) is
+
+    def zone(self, zone_id):
+        return self.zones.get(zone_id)
+
+    def zone_list(self):
+        with self._lock:
+            return [z.summary() for z in self.zones.values()]
+
+    def all_staff(self):
+        with self._lock:
+            return [dict(p) for p in self.staff.values()]
+
+    def present_staff(self):
+        with self._lock:
+            return [dict(p) for p in self.staff.values() if p['is_present']]
+
+    def roster_snapshot(self):
+        # The classic /get_staff body ("uid:1,uid:0,..."), rebuilt only when the roster changes
+        with self._lock:
+            if self._roster_snapshot[0] != self.roster_version:
+                body = ",".join(f"{p['uid']}:{p['is_present']}" for p in self.staff.values())
+                self._roster_snapshot = (self.roster_version, body)
+            return self._roster_snapshot[1]
+
+    def roster_changes(self, since):
+        # Returns (version, is_full, body). body is a snapshot when `since` is 0, newer than
+        # anything we know (e.g. after a restart lost unsaved changes) or older than the
+        # journal; otherwise only the cards changed since then, with removals as "uid:-".
+        with self._lock:
+            version = self.roster_version
+            if since <= 0: return version, True, self.roster_snapshot()  # a device starting from scratch, even at version 0
+            if since == version: return version, False, ''
+            oldest = self.roster_journal[0][0] if self.roster_journal else version + 1
+            if since > version or since < oldest - 1:
+                return version, True, self.roster_snapshot()
+            changes = {}
+            for seq, uid, is_present in reversed(self.roster_journal):
+                if seq <= since: break
+                changes.setdefault(uid, is_present)
+            return version, False, ",".join(f"{uid}:{'-' if p is None else p}" for uid, p in reversed(changes.items()))
+
+    def _devices_now(self):
+        # (device summaries, ids of zones with a device online). Called before taking self._lock: the
+        # sweep inside may write an offline flip to the database and publish it, and must not hold up
+        # every other read and write in the meantime.
+        devices = self.devices.summary()
+        return devices, {d['zone'] for d in devices if d['online']}
+
+    def admin_stats(self):
+        devices, online = self._devices_now()
+        with self._lock:
+            zones = [dict(z.summary(), system_status=int(z.id in online)) for z in self.zones.values()]
+            return {"seats": self.available_seats, "total_capacity": self.total_capacity, "system_status": int(bool(online)),
+                    "devices": devices, "zones": zones}
+
+    def _zone_stats(self, z, local_now, online):
+        return dict(seat_stats(z.total_capacity, z.available_seats, z.slots.held_now(local_now)),
+                    id=z.id, name=z.name, available_seats=z.available_seats, system_status=int(z.id in online))
+
+    def zone_stats(self, online=None):
+        # Seat numbers for every zone (the campus breakdown)
+        if online is None: online = self._devices_now()[1]
+        local_now = datetime.now(SL_TZ)
+        with self._lock:
+            return [self._zone_stats(z, local_now, online) for z in self.zones.values()]
+
+    def pushed_stats(self, zone_id):
+        # What a door event or booking pushes to open pages: the campus totals and only the zone that
+        # changed, so its cost doesn't grow with the number of zones or devices
+        online = self._devices_now()[1]
+        local_now = datetime.now(SL_TZ)
+        with self._lock:
+            stats = seat_stats(self.total_capacity, self.available_seats, self.slots.held_now(local_now))
+            zone = self.zones.get(zone_id)
+            stats.update({
+                "staff": self.staff_present,
+                "system_status": int(bool(online)),
+                "announcement": self.announcement,
+                "announcement_time": self.announcement_time,
+                "available_seats": self.available_seats,
+                "zones": [self._zone_stats(zone, local_now, online)] if zone else [],
+            })
+            return stats
+
+    def dashboard_stats(self, zone_id=None):
+        # One zone's numbers, or the campus totals (with the per-zone breakdown) when zone_id is None
+        devices, online = self._devices_now()
+        local_now = datetime.now(SL_TZ)
+        with self._lock:
+            zone = self.zones.get(zone_id) if zone_id is not None else None
+            if zone is not None:
+                stats = seat_stats(zone.total_capacity, zone.available_seats, zone.slots.held_now(local_now))
+                devices = [d for d in devices if d['zone'] == zone.id]
+            else:
+                stats = seat_stats(self.total_capacity, self.available_seats, self.slots.held_now(local_now))
+            stats.update({
+                "staff": self.staff_present,
+                "system_status": int(zone.id in online if zone else bool(online)),
+                "devices": devices,
+                "announcement": self.announcement,
+                "announcement_time": self.announcement_time,
+                "zone": zone.summary() if zone else None,
+            })
+            if zone is None: stats['zones'] = self.zone_stats(online)
+            return stats
+
+live = LiveState()
@@ -0,0 +1,36 @@
+// Conditional fetch: resolves to null when the server says nothing changed (304)
+const liveEtags = {};
+function fetchIfChanged(url) {
+    const headers = liveEtags[url] ? { 'If-None-Match': liveEtags[url] } : {};
+    return fetch(url, { headers: headers, cache: 'no-store' }).then(r => {
+        if (r.status === 304) return null;
+        liveEtags[url] = r.headers.get('ETag');
+        return r;
+    });
+}
+
+// Live updates: listen on the server event stream and fall back to the old
+// 2-second polling if the browser can't do SSE or the server turns us away.
+function subscribeLive(topics, handlers, poll) {
+    let timer = null;
+
+    function startPolling() {
+        if (timer) return;
+        poll();
+        timer = setInterval(poll, 2000);
+    }
+
+    if (!window.EventSource) { startPolling(); return; }
+
+    const source = new EventSource('/api/stream?topics=' + topics.join(','));
+    topics.forEach(topic => {
+        source.addEventListener(topic, e => handlers[topic](JSON.parse(e.data)));
+    });
+    source.onopen = () => {
+        if (timer) { clearInterval(timer); timer = null; }
+    };
+    source.onerror = () => {
+        // CLOSED means the server refused us (e.g. subscriber cap); otherwise the browser retries
+        if (source.readyState === EventSource.CLOSED) startPolling();
+    };
+}
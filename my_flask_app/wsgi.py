@@ -0,0 +1,7 @@
+# --- PRODUCTION ENTRY POINT ---
+# gunicorn -c gunicorn.conf.py  (the config points here). Each worker builds
+# its own live state; the schema was already migrated once in the gunicorn
+# master (on_starting), so workers only check its version.
+from app import create_app
+
+application = create_app(migrate_schema=False)
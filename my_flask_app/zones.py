@@ -0,0 +1,37 @@
+from slots import SlotCounters
+
+# --- ZONES ---
+# One server can run several reading rooms ("zones"), each with its own
+# doors, capacity, occupancy and bookings. Each zone keeps its own counters in
+# memory, so a zone's dashboard and door traffic only touch that zone's
+# numbers, however many zones there are. The campus view is the sum of all
+# zones, and LiveState keeps that sum up to date as the zones change. Zone 1 is
+# the original library: devices and pages that don't name a zone get it.
+
+DEFAULT_ZONE = 1
+
+
+class Zone:
+    def __init__(self, zone_id, name, total_capacity, available_seats):
+        self.id = zone_id
+        self.name = name
+        self.total_capacity = total_capacity
+        self.available_seats = available_seats
+        self.slots = SlotCounters()  # this zone's unused bookings per (date, slot)
+
+    def summary(self):
+        return {'id': self.id, 'name': self.name, 'total_capacity': self.total_capacity, 'available_seats': self.available_seats}
+
+
+def seat_stats(total, available, held):
+    # 1. People physically inside; 2. true available seats = capacity - inside - booked for the current slot
+    occupancy = max(0, total - available)
+    return {"seats": max(0, total - occupancy - held), "occupancy": occupancy, "reservations": held, "total_capacity": total}
+
+
+def parse_zone_id(value):
+    # Zone ids arrive as header/JSON/query values; None if it isn't one
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None